@@ -0,0 +1,65 @@
+'''
+This file contains the on-disk cache of simulation results. The statistics of every
+seeded run are stored in an SQLite database under a hash of everything the run depends
+on: the initial network, the parameter combination, the stop time, the seed, the
+simulation settings and whether the random numbers are drawn with NumPy. A sweep that
+is run again only simulates the combinations it hasn't seen before.
+'''
+import os
+import json
+import sqlite3
+import hashlib
+
+
+def canonical(value):
+    ''' Function that turns a value made of dicts, lists and tuples into nested tuples,
+    with the dict items sorted, so that equal values always get the same repr'''
+    if isinstance(value, dict):
+        return tuple(sorted([(canonical(key), canonical(item)) for (key, item) in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([canonical(item) for item in value])
+    return value
+
+
+def getKey(*parts):
+    ''' Function that gets the cache key of a run from the values it depends on'''
+    return hashlib.sha1(repr(canonical(parts))).hexdigest()
+
+
+class ResultCache(object):
+    ''' A class representing the cache of simulation results. Every process opens its own
+    connection to the database, so the cache can be shared by a pool of workers'''
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.connection = None
+        self.pid = None
+
+
+    def getConnection(self):
+        ''' Method that gets the connection to the database of this process, opening it
+        and creating the table if needed'''
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.fileName, timeout=60)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                    '(key TEXT PRIMARY KEY, statistics TEXT)')
+            self.connection.commit()
+            self.pid = os.getpid()
+        return self.connection
+
+
+    def get(self, key):
+        ''' Method that gets the statistics stored under the given key, or None'''
+        connection = self.getConnection()
+        row = connection.execute('SELECT statistics FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return [(str(name), value) for (name, value) in json.loads(row[0])]
+
+
+    def put(self, key, statistics):
+        ''' Method that stores the statistics under the given key'''
+        connection = self.getConnection()
+        connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?)',
+                           (key, json.dumps(statistics)))
+        connection.commit()
+
@@ -0,0 +1,64 @@
+'''
+This file contains the checkpoints of long experimentation and optimisation jobs. The
+results of the finished parameter combinations are kept in memory and written to a file
+every so often, so that a job that was stopped can be started again without simulating
+the finished combinations. The file is written to a temporary file first and renamed,
+so a job that is killed while writing it leaves the previous checkpoint intact.
+'''
+import os
+import time
+import cPickle
+
+# The least time between two writes of the checkpoint file, in seconds:
+CHECKPOINT_INTERVAL = 30.0
+
+
+class Checkpoint(object):
+    ''' A class representing the checkpoint of a job. The job is identified by a key made
+    from its input, and a checkpoint file written for another job is not used. The seed
+    of the job is saved too, so that the restarted job uses the same one'''
+    def __init__(self, fileName, job):
+        self.fileName = fileName
+        self.job = job
+        self.results = {}
+        self.seed = None
+        self.lastWrite = time.time()
+        if os.path.exists(fileName):
+            data = cPickle.load(open(fileName, 'rb'))
+            if data['job'] != job:
+                raise Exception('The checkpoint file {0} was written for a different input'.format(fileName))
+            self.results = data['results']
+            self.seed = data['seed']
+
+
+    def __contains__(self, key):
+        return key in self.results
+
+
+    def get(self, key):
+        ''' Method that gets the result stored under the given key'''
+        return self.results[key]
+
+
+    def add(self, key, result):
+        ''' Method that stores the result of a finished combination, writing the checkpoint
+        file if it hasn't been written for a while'''
+        self.results[key] = result
+        if time.time() - self.lastWrite >= CHECKPOINT_INTERVAL:
+            self.write()
+
+
+    def write(self):
+        ''' Method that writes the checkpoint file'''
+        temporaryName = self.fileName + '.tmp'
+        temporaryFile = open(temporaryName, 'wb')
+        cPickle.dump({'job' : self.job, 'seed' : self.seed, 'results' : self.results}, temporaryFile, 2)
+        temporaryFile.close()
+        os.rename(temporaryName, self.fileName)
+        self.lastWrite = time.time()
+
+
+    def finish(self):
+        ''' Method that removes the checkpoint file once the job is finished'''
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
@@ -0,0 +1,414 @@
+'''
+This file contains alternative simulation engines. The default engine is the loop in
+Simulation.executeSimulationLoop, which recalculates the total event rate and picks
+an event category on every step. The engines here work on the same Network object
+and produce the same statistics.
+
+The default loop draws its delays as -(1/rate) * log10(u). The engines draw them the
+same way from the network's random stream, so that their results can be compared
+with the default loop. A rate r in the default loop therefore means r * ln(10)
+events per unit of time.
+'''
+import heapq
+from math import exp, log, sqrt
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def drawDelay(rng, rate):
+    ''' Function that draws the time until an event with the given rate happens'''
+    return rng.exponential() / rate
+
+
+def drawPoisson(rng, mean):
+    ''' Function that draws the number of events that happen in a period where
+    the given number of events is expected'''
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        # The normal approximation is good enough for the large means:
+        return max(0, int(rng.gauss(mean, sqrt(mean)) + 0.5))
+    limit = exp(-mean)
+    count = 0
+    product = rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class NextReactionEngine(object):
+    ''' An engine that implements the next reaction method of Gibson and Bruck. Every source
+    of events (new passengers, boarding, disembarking and departing at each stop, and every
+    moving bus) has its own scheduled time in a priority queue. After an event only the sources
+    whose rates changed are rescheduled, so an event costs O(log n) instead of O(n)'''
+    def __init__(self, network, stopTime, outputEvents=True, stopCondition=None):
+        self.network = network
+        self.stopTime = stopTime
+        self.outputEvents = outputEvents
+        self.stopCondition = stopCondition
+        self.queue = []
+        self.times = {}
+        self.rates = {}
+        self.counter = 0
+
+
+    def schedule(self, key, rate, now):
+        ''' Method that sets the rate of an event source and reschedules it. The time of a source
+        that is still scheduled is rescaled to the new rate instead of drawing a new random number'''
+        oldRate = self.rates.get(key, 0)
+        oldTime = self.times.get(key)
+        if rate == oldRate and oldTime is not None:
+            return
+        self.rates[key] = rate
+        if rate <= 0:
+            self.times[key] = None
+            return
+        if oldRate > 0 and oldTime is not None:
+            time = now + (oldRate/rate) * (oldTime - now)
+        elif key[0] == 'new':
+            time = now + drawDelay(self.network.arrivalRng, rate)
+        else:
+            time = now + drawDelay(self.network.rng, rate)
+        self.times[key] = time
+        self.counter += 1
+        heapq.heappush(self.queue, (time, self.counter, key))
+
+
+    def scheduleStop(self, stopID, now):
+        ''' Method that reschedules the boarding, disembarking and departing events of a stop'''
+        network = self.network
+        self.schedule(('board', stopID), network.paxRTB[stopID] * network.params['board'], now)
+        self.schedule(('disembark', stopID), network.paxRTD[stopID] * network.params['disembarks'], now)
+        self.schedule(('depart', stopID), len(network.busesRTD[stopID]) * network.params['departs'], now)
+
+
+    def run(self):
+        ''' Method that runs the simulation until the stop time. It returns False if the
+        run was stopped by the stop condition'''
+        network = self.network
+        network.changedStops = set()
+        self.schedule(('new',), network.params['new passengers'], 0.0)
+        for stopID in network.stops:
+            self.scheduleStop(stopID, 0.0)
+        for (bus, route) in network.getBusesRTA():
+            self.schedule(('arrive', bus), network.getThroughput(bus), 0.0)
+        events = 0
+        completed = True
+        while self.queue:
+            (time, counter, key) = heapq.heappop(self.queue)
+            if self.times.get(key) != time:
+                # The source was rescheduled after this entry had been added:
+                continue
+            if time > self.stopTime:
+                break
+            if self.stopCondition is not None:
+                events += 1
+                if (events % 256 == 0) and self.stopCondition():
+                    completed = False
+                    break
+            # The source that fires has to draw a new time:
+            self.times[key] = None
+            network.changedStops.clear()
+            if key[0] == 'new':
+                network.addPassenger(time, self.outputEvents)
+                self.schedule(key, self.rates[key], time)
+            elif key[0] == 'arrive':
+                network.arriveGivenBus(key[1], time, self.outputEvents)
+                self.schedule(key, 0, time)
+            elif key[0] == 'board':
+                stop = network.stops[key[1]]
+                index = network.boardRng.index(network.paxRTB[key[1]])
+                network.boardPassengerAt(stop, index, time, self.outputEvents)
+            elif key[0] == 'disembark':
+                stop = network.stops[key[1]]
+                index = network.disembarkRng.index(network.paxRTD[key[1]])
+                network.disembarkPassengerAt(stop, index, time, self.outputEvents)
+            else:
+                stop = network.stops[key[1]]
+                index = network.departRng.index(len(network.busesRTD[key[1]]))
+                bus = network.departBusAt(stop, index, time, self.outputEvents)
+                self.schedule(('arrive', bus), network.getThroughput(bus), time)
+            for stopID in network.changedStops:
+                self.scheduleStop(stopID, time)
+        network.changedStops = None
+        network.eventSink.flush()
+        if completed:
+            network.finishTakingStatistics(self.stopTime)
+        return completed
+
+
+class TauLeapingEngine(object):
+    ''' An approximate engine that advances the time in leaps of at most tau. The new passengers,
+    boardings and disembarkings of a leap are drawn from Poisson distributions and carried out
+    together. The bus departures and arrivals are handled exactly: the time of the next one
+    is drawn first and a leap never goes past it, so a leap ends either after tau or with
+    a single bus event'''
+    def __init__(self, network, stopTime, tau, outputEvents=True, stopCondition=None):
+        self.network = network
+        self.stopTime = stopTime
+        self.tau = tau
+        self.outputEvents = outputEvents
+        self.stopCondition = stopCondition
+
+
+    def leapPassengers(self, time, length):
+        ''' Method that carries out the passenger events of a leap of the given length. The numbers
+        of events are drawn from the rates at the start of the leap and are cut down if there are
+        not enough passengers left to carry them out'''
+        network = self.network
+        scale = length * log(10)
+        boardings = []
+        disembarkings = []
+        for stop in network.stops.values():
+            if network.paxRTD[stop.stopID]:
+                disembarkings.append((stop, drawPoisson(network.disembarkRng, network.paxRTD[stop.stopID] * network.params['disembarks'] * scale)))
+            if network.paxRTB[stop.stopID]:
+                boardings.append((stop, drawPoisson(network.boardRng, network.paxRTB[stop.stopID] * network.params['board'] * scale)))
+        network.addPassengers(drawPoisson(network.arrivalRng, network.params['new passengers'] * scale), time, self.outputEvents)
+        for (stop, count) in disembarkings:
+            if count:
+                network.disembarkPassengersAt(stop, count, time, self.outputEvents)
+        for (stop, count) in boardings:
+            if count and network.paxRTB[stop.stopID]:
+                network.boardPassengersAt(stop, count, time, self.outputEvents)
+
+
+    def moveBus(self, time):
+        ''' Method that departs or arrives a bus, picked by the current rates of those events'''
+        network = self.network
+        departRate = network.totalBusesRTD * network.params['departs']
+        totalRate = departRate + network.busesRTA.total()
+        if totalRate == 0:
+            return
+        if network.rng.random() * totalRate < departRate:
+            network.departBus(time, self.outputEvents)
+        else:
+            network.arriveBus(time, self.outputEvents)
+
+
+    def run(self):
+        ''' Method that runs the simulation until the stop time. It returns False if the
+        run was stopped by the stop condition'''
+        network = self.network
+        time = 0.0
+        leaps = 0
+        completed = True
+        while time < self.stopTime:
+            if self.stopCondition is not None:
+                leaps += 1
+                if (leaps % 256 == 0) and self.stopCondition():
+                    completed = False
+                    break
+            busRate = network.totalBusesRTD * network.params['departs'] + network.busesRTA.total()
+            length = min(self.tau, self.stopTime - time)
+            busMoves = False
+            if busRate > 0:
+                delay = drawDelay(network.rng, busRate)
+                if delay < length:
+                    (length, busMoves) = (delay, True)
+            self.leapPassengers(time, length)
+            time += length
+            if busMoves:
+                self.moveBus(time)
+        network.eventSink.flush()
+        if completed:
+            network.finishTakingStatistics(self.stopTime)
+        return completed
+
+
+def sampleRows(rng, weights):
+    ''' Function that picks an index in every row of the given 2D array, with the probability
+    proportional to the weight at that index. Every row must have some positive weight'''
+    cumulative = weights.cumsum(axis=1)
+    values = rng.random_sample(len(weights)) * cumulative[:, -1]
+    return (cumulative <= values[:, None]).sum(axis=1)
+
+
+class VectorisedEngine(object):
+    ''' An engine that runs many independent replications of the simulation at once. The state of
+    every replication is kept in NumPy arrays (passengers are counted per stop or bus and per
+    destination), and every step carries out one event in each replication with whole-array
+    operations. The replications start from the state of the network, which is left untouched.
+    No events are reported; the statistics of a replication are put into the network objects
+    by storeStatistics, so that they can be read as after any other run. The engine is
+    experimental, as it is only tested where NumPy is installed'''
+    def __init__(self, network, stopTime, replications, rng):
+        if numpy is None:
+            raise Exception('The vectorised engine needs NumPy to be installed')
+        self.network = network
+        self.stopTime = stopTime
+        self.replications = replications
+        self.rng = rng
+        # Numbering the stops, routes and buses:
+        self.stopIDs = network.stops.keys()
+        self.routeIDs = network.routes.keys()
+        self.buses = []
+        for route in network.routes.values():
+            self.buses.extend(route.buses)
+        stopIndex = dict([(stopID, i) for (i, stopID) in enumerate(self.stopIDs)])
+        routeIndex = dict([(routeID, i) for (i, routeID) in enumerate(self.routeIDs)])
+        (R, S, B) = (replications, len(self.stopIDs), len(self.buses))
+        # The parts of the network that don't change during a run:
+        self.reachable = numpy.zeros((S, S))
+        for stop in network.stops.values():
+            for stopID in stop.reachableStops:
+                self.reachable[stopIndex[stop.stopID], stopIndex[stopID]] = 1
+        self.routeStops = numpy.zeros((len(self.routeIDs), S), dtype=int)
+        for (i, routeID) in enumerate(self.routeIDs):
+            for stopID in network.routes[routeID].stopSet:
+                self.routeStops[i, stopIndex[stopID]] = 1
+        self.busRoute = numpy.array([routeIndex[bus.routeID] for bus in self.buses], dtype=int)
+        self.capacity = numpy.array([bus.capacity for bus in self.buses], dtype=int)
+        self.nextStop = numpy.zeros((B, S), dtype=int)
+        self.throughput = numpy.zeros((B, S))
+        for (b, bus) in enumerate(self.buses):
+            route = network.routes[bus.routeID]
+            for (stopID, nextStopID) in route.nextStops.items():
+                self.nextStop[b, stopIndex[stopID]] = stopIndex[nextStopID]
+                self.throughput[b, stopIndex[stopID]] = route.nextThroughputs[stopID]
+        # The state of every replication, starting from the state of the network:
+        self.waiting = numpy.zeros((R, S, S), dtype=int)
+        for stop in network.stops.values():
+            for pax in stop.passengers:
+                self.waiting[:, stopIndex[stop.stopID], stopIndex[pax.destStopID]] += 1
+        self.load = numpy.zeros((R, B, S), dtype=int)
+        self.location = numpy.zeros((R, B), dtype=int)
+        self.moving = numpy.zeros((R, B), dtype=bool)
+        for (b, bus) in enumerate(self.buses):
+            for pax in bus.passengers:
+                self.load[:, b, stopIndex[pax.destStopID]] += 1
+            self.location[:, b] = stopIndex[bus.location]
+            self.moving[:, b] = (bus.status == 'Moving')
+        # The buses queue in the order of these numbers:
+        self.order = numpy.zeros((R, B), dtype=int)
+        self.queueLength = numpy.zeros((R, S), dtype=int)
+        self.front = numpy.zeros((R, S), dtype=int)
+        for stop in network.stops.values():
+            for (position, bus) in enumerate(stop.qOfBuses):
+                self.order[:, self.buses.index(bus)] = position
+            self.queueLength[:, stopIndex[stop.stopID]] = len(stop.qOfBuses)
+            if stop.qOfBuses:
+                self.front[:, stopIndex[stop.stopID]] = self.buses.index(stop.qOfBuses[0])
+        self.counter = B
+        # Totals that are kept up to date instead of being summed up on every step:
+        self.busLoad = self.load.sum(axis=2)
+        self.routeWaiting = numpy.dot(self.waiting, self.routeStops.T)
+        # Statistics of every replication:
+        stops = self.getStops()
+        self.stopMissed = numpy.array([[stop.missedPassengers for stop in stops]] * R, dtype=int)
+        self.routeMissed = numpy.array([[network.routes[routeID].missedPassengers for routeID in self.routeIDs]] * R, dtype=int)
+        self.averagePassengers = numpy.array([[bus.averagePassengersTravelling for bus in self.buses]] * R)
+        self.numberOfStops = numpy.array([[bus.numberOfStops for bus in self.buses]] * R, dtype=int)
+        self.queueingTime = numpy.array([[stop.totalQueueingTime for stop in stops]] * R)
+        self.queueChangeTime = numpy.array([[stop.busQChangeTime for stop in stops]] * R)
+        self.busesQueued = numpy.array([[stop.numberOfBusesQueued for stop in stops]] * R, dtype=int)
+        self.time = numpy.zeros(R)
+
+
+    def getStops(self):
+        ''' Method that gets the stops of the network in the order of their numbers'''
+        return [self.network.stops[stopID] for stopID in self.stopIDs]
+
+
+    def run(self):
+        ''' Method that runs all of the replications until the stop time'''
+        params = self.network.params
+        (R, B, S) = (self.replications, len(self.buses), len(self.stopIDs))
+        rows = numpy.arange(R)
+        buses = numpy.arange(B)
+        while True:
+            active = self.time <= self.stopTime
+            if not active.any():
+                break
+            # Passengers that can board the buses at the front of the queues:
+            frontRoute = self.busRoute[self.front]
+            canBoard = (self.queueLength > 0) & (self.busLoad[rows[:, None], self.front] < self.capacity[self.front])
+            paxRTB = self.routeWaiting[rows[:, None], numpy.arange(S), frontRoute] * canBoard
+            # Passengers getting off and buses that can leave:
+            paxRTD = self.load[rows[:, None], buses, self.location] * ~self.moving
+            waitingForBus = self.routeWaiting[rows[:, None], self.location, self.busRoute]
+            busesRTD = ~self.moving & (paxRTD == 0) & ((self.busLoad >= self.capacity) | (waitingForBus == 0))
+            busesRTA = self.throughput[buses, self.location] * self.moving
+            # Choosing the kinds of events the same way as the default loop:
+            rates = numpy.column_stack((paxRTB.sum(axis=1) * params['board'],
+                                        paxRTD.sum(axis=1) * params['disembarks'],
+                                        busesRTD.sum(axis=1) * params['departs'],
+                                        busesRTA.sum(axis=1),
+                                        numpy.repeat(params['new passengers'], R)))
+            totalRate = rates.sum(axis=1)
+            active &= totalRate > 0
+            choice = (rates.cumsum(axis=1) <= (self.rng.random_sample(R) * totalRate)[:, None]).sum(axis=1)
+            delay = -numpy.log10(1.0 - self.rng.random_sample(R)) / numpy.where(active, totalRate, 1.0)
+            # Boarding:
+            r = rows[active & (choice == 0)]
+            if len(r):
+                s = sampleRows(self.rng, paxRTB[r])
+                b = self.front[r, s]
+                d = sampleRows(self.rng, self.waiting[r, s] * self.routeStops[self.busRoute[b]])
+                self.waiting[r, s, d] -= 1
+                self.routeWaiting[r, s] -= self.routeStops[:, d].T
+                self.load[r, b, d] += 1
+                self.busLoad[r, b] += 1
+            # Disembarking:
+            r = rows[active & (choice == 1)]
+            if len(r):
+                b = sampleRows(self.rng, paxRTD[r])
+                self.load[r, b, self.location[r, b]] -= 1
+                self.busLoad[r, b] -= 1
+            # Departing:
+            r = rows[active & (choice == 2)]
+            if len(r):
+                b = sampleRows(self.rng, busesRTD[r].astype(float))
+                s = self.location[r, b]
+                self.queueingTime[r, s] += (self.time[r] - self.queueChangeTime[r, s]) * (self.queueLength[r, s] - 1)
+                self.queueChangeTime[r, s] = self.time[r]
+                self.moving[r, b] = True
+                self.queueLength[r, s] -= 1
+                queued = (self.location[r] == s[:, None]) & ~self.moving[r]
+                self.front[r, s] = numpy.where(queued, self.order[r], self.counter).argmin(axis=1)
+                self.stopMissed[r, s] += waitingForBus[r, b]
+                self.routeMissed[r, self.busRoute[b]] += waitingForBus[r, b]
+                self.averagePassengers[r, b] = ((self.averagePassengers[r, b] * self.numberOfStops[r, b] + self.busLoad[r, b]) /
+                                                (self.numberOfStops[r, b] + 1.0))
+                self.numberOfStops[r, b] += 1
+            # Arriving:
+            r = rows[active & (choice == 3)]
+            if len(r):
+                b = sampleRows(self.rng, busesRTA[r])
+                s = self.nextStop[b, self.location[r, b]]
+                self.queueingTime[r, s] += (self.time[r] - self.queueChangeTime[r, s]) * numpy.maximum(self.queueLength[r, s] - 1, 0)
+                self.queueChangeTime[r, s] = self.time[r]
+                self.front[r, s] = numpy.where(self.queueLength[r, s] == 0, b, self.front[r, s])
+                self.queueLength[r, s] += 1
+                self.location[r, b] = s
+                self.moving[r, b] = False
+                self.order[r, b] = self.counter
+                self.counter += 1
+                self.busesQueued[r, s] += 1
+            # New passengers:
+            r = rows[active & (choice == 4)]
+            if len(r):
+                s = self.rng.randint(0, S, len(r))
+                d = sampleRows(self.rng, self.reachable[s])
+                self.waiting[r, s, d] += 1
+                self.routeWaiting[r, s] += self.routeStops[:, d].T
+            self.time = numpy.where(active, self.time + delay, numpy.inf)
+        # Finishing the queueing statistics:
+        self.queueingTime += (self.stopTime - self.queueChangeTime) * numpy.maximum(self.queueLength - 1, 0)
+        return True
+
+
+    def storeStatistics(self, replication):
+        ''' Method that puts the statistics of the given replication into the network objects'''
+        for (s, stop) in enumerate(self.getStops()):
+            stop.missedPassengers = int(self.stopMissed[replication, s])
+            stop.totalQueueingTime = float(self.queueingTime[replication, s])
+            stop.numberOfBusesQueued = int(self.busesQueued[replication, s])
+        for (i, routeID) in enumerate(self.routeIDs):
+            self.network.routes[routeID].missedPassengers = int(self.routeMissed[replication, i])
+        for (b, bus) in enumerate(self.buses):
+            bus.averagePassengersTravelling = float(self.averagePassengers[replication, b])
+            bus.numberOfStops = int(self.numberOfStops[replication, b])
@@ -0,0 +1,90 @@
+'''
+This file contains the event sinks that the bus network reports its events to.
+A sink decides what happens to the events: they can be formatted and written out
+in large blocks, kept unformatted until they are written or thrown away.
+'''
+import sys
+
+
+# Types of the events that happen in the bus network:
+NEW_PASSENGER = 0
+BOARD = 1
+DISEMBARK = 2
+DEPART = 3
+ARRIVE = 4
+
+
+def formatEvent(time, eventType, routeID, busNumber, stopID, destStopID):
+    ''' Function that formats an event as the line of text that describes it. The time is
+    always written as a float, whichever engine the event came from or if it was read back
+    from a binary trace, so the same event always gives the same line'''
+    time = float(time)
+    bus = str(routeID) + '.' + str(busNumber)
+    if eventType == NEW_PASSENGER:
+        return 'A new passenger enters at stop {0} with destination {1} at time {2}'.format(stopID, destStopID, time)
+    elif eventType == BOARD:
+        return 'Passenger boards bus {0} at stop {1} with destination {2} at time {3}'.format(bus, stopID, destStopID, time)
+    elif eventType == DISEMBARK:
+        return 'Passenger disembarks bus {0} at stop {1} at time {2}'.format(bus, stopID, time)
+    elif eventType == DEPART:
+        return 'Bus {0} leaves stop {1} at time {2}'.format(bus, stopID, time)
+    elif eventType == ARRIVE:
+        return 'Bus {0} arrives at stop {1} at time {2}'.format(bus, stopID, time)
+    else:
+        raise Exception('Unknown event type {0}'.format(eventType))
+
+
+class NullSink(object):
+    ''' An event sink that throws all events away without formatting them'''
+    def event(self, time, eventType, routeID, busNumber, stopID, destStopID):
+        ''' Method that receives an event from the bus network'''
+        pass
+
+
+    def flush(self):
+        ''' Method that writes out all of the events received so far'''
+        pass
+
+
+    def close(self):
+        ''' Method that writes out the remaining events and releases the output'''
+        pass
+
+
+class TextSink(object):
+    ''' An event sink that writes events as lines of text. The lines are kept in a buffer
+    and written to the stream in blocks of bufferSize lines. If lazy is set, the events
+    are only formatted when the block is written. Without a stream the lines go to stdout'''
+    def __init__(self, stream=None, bufferSize=4096, lazy=False):
+        self.stream = stream
+        self.bufferSize = bufferSize
+        self.lazy = lazy
+        self.buffer = []
+
+
+    def event(self, time, eventType, routeID, busNumber, stopID, destStopID):
+        ''' Method that receives an event from the bus network'''
+        if self.lazy:
+            self.buffer.append((time, eventType, routeID, busNumber, stopID, destStopID))
+        else:
+            self.buffer.append(formatEvent(time, eventType, routeID, busNumber, stopID, destStopID))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+
+    def flush(self):
+        ''' Method that writes out all of the events received so far'''
+        if self.buffer:
+            if self.lazy:
+                lines = [formatEvent(*event) for event in self.buffer]
+            else:
+                lines = self.buffer
+            (self.stream or sys.stdout).write('\n'.join(lines) + '\n')
+            self.buffer = []
+
+
+    def close(self):
+        ''' Method that writes out the remaining events and releases the output'''
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
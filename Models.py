@@ -3,10 +3,19 @@ This file contains class descriptions for all kinds of objects
 used in the simulation to mimic the real world: stops, roads, passengers and etc.
 '''
 import random
+from copy import deepcopy
+import Events
+import RandomStreams
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-class Passenger:
+class Passenger(object):
     ''' A class representing a passenger in bus network'''
+    __slots__ = ('destStopID',)
+
     def __init__(self, destStopID):
         self.destStopID = destStopID
         
@@ -14,15 +23,123 @@ class Passenger:
     def __eq__(self, another):
         return self.destStopID == another.destStopID    
         
-class Bus:
+class PassengerList(list):
+    ''' A class representing passengers (in a stop or a bus) stored one by one, in the order they came'''
+    __slots__ = ()
+
+    def countFor(self, stopIDs):
+        ''' This method counts the passengers whose destination is one of the given stops'''
+        count = 0
+        for pax in self:
+            if (pax.destStopID in stopIDs):
+                count += 1
+        return count
+
+
+    def countTo(self, stopID):
+        ''' This method counts the passengers whose destination is the given stop'''
+        count = 0
+        for pax in self:
+            if pax.destStopID == stopID:
+                count += 1
+        return count
+
+
+    def takeFor(self, stopIDs, index):
+        ''' This method removes and returns the passenger with the given index among the
+        passengers whose destination is one of the given stops'''
+        for (position, pax) in enumerate(self):
+            if (pax.destStopID in stopIDs):
+                if index == 0:
+                    return self.pop(position)
+                index -= 1
+
+
+    def takeTo(self, stopID):
+        ''' This method removes and returns a passenger whose destination is the given stop'''
+        return self.pop(self.index(Passenger(stopID)))
+
+
+class PassengerGroups(object):
+    ''' A class representing passengers (in a stop or a bus) stored as the number of
+    passengers going to every destination. Passenger objects are only created when
+    a passenger is taken out, so busy stops don't need to keep them in memory'''
+    __slots__ = ('counts', 'size')
+
+    def __init__(self, passengers=[]):
+        self.counts = {}
+        self.size = 0
+        for pax in passengers:
+            self.append(pax)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __iter__(self):
+        # The destinations are sorted, so that the order doesn't depend on the history of the dict:
+        for (destStopID, count) in sorted(self.counts.items()):
+            for i in range(count):
+                yield Passenger(destStopID)
+
+
+    def __eq__(self, another):
+        return sorted([pax.destStopID for pax in self]) == sorted([pax.destStopID for pax in another])
+
+
+    def append(self, pax):
+        ''' This method adds a passenger to the group of his destination'''
+        self.counts[pax.destStopID] = self.counts.get(pax.destStopID, 0) + 1
+        self.size += 1
+
+
+    def countFor(self, stopIDs):
+        ''' This method counts the passengers whose destination is one of the given stops'''
+        count = 0
+        for (destStopID, number) in self.counts.items():
+            if (destStopID in stopIDs):
+                count += number
+        return count
+
+
+    def countTo(self, stopID):
+        ''' This method counts the passengers whose destination is the given stop'''
+        return self.counts.get(stopID, 0)
+
+
+    def takeFor(self, stopIDs, index):
+        ''' This method removes and returns the passenger with the given index among the
+        passengers whose destination is one of the given stops'''
+        for (destStopID, number) in sorted(self.counts.items()):
+            if (destStopID in stopIDs):
+                if index < number:
+                    return self.takeTo(destStopID)
+                index -= number
+
+
+    def takeTo(self, stopID):
+        ''' This method removes and returns a passenger whose destination is the given stop'''
+        if self.counts[stopID] == 1:
+            del self.counts[stopID]
+        else:
+            self.counts[stopID] -= 1
+        self.size -= 1
+        return Passenger(stopID)
+
+
+class Bus(object):
     ''' A class representing a bus going on some route in the bus network'''
+    __slots__ = ('routeID', 'busNumber', 'capacity', 'status', 'location', 'passengers',
+                 'numberOfStops', 'averagePassengersTravelling')
+
     def __init__(self, routeID, busNumber, capacity, location):
         self.routeID = routeID
         self.busNumber = busNumber
         self.capacity = capacity
         self.status = 'Queueing'
         self.location = location
-        self.passengers = []
+        self.passengers = PassengerList()
         self.numberOfStops = 0
         self.averagePassengersTravelling = 0.0
 
@@ -35,12 +152,15 @@ class Bus:
                 (self.averagePassengersTravelling == another.averagePassengersTravelling))
 
         
-class Stop:
+class Stop(object):
     ''' A class representing a bus stop in the bus network'''
+    __slots__ = ('stopID', 'qOfBuses', 'passengers', 'reachableStops', 'missedPassengers',
+                 'totalQueueingTime', 'busQChangeTime', 'numberOfBusesQueued')
+
     def __init__(self, stopID):
         self.stopID = stopID
         self.qOfBuses = []
-        self.passengers = []
+        self.passengers = PassengerList()
         self.reachableStops = []
         self.missedPassengers = 0
         # Attributes for average bus queueing time:
@@ -71,14 +191,23 @@ class Stop:
         self.numberOfBusesQueued += 1
                 
     
-class Route:
+class Route(object):
     ''' A class representing a particular route in the bus network'''
+    __slots__ = ('routeID', 'stopSequence', 'capacity', 'buses', 'missedPassengers',
+                 'stopSet', 'nextStops', 'nextThroughputs')
+
     def __init__(self, stopSequence, routeID, capacity):
         self.routeID = routeID
         self.stopSequence = stopSequence
         self.capacity = capacity
         self.buses = []
         self.missedPassengers = 0
+        # Lookups that spare scanning the stop sequence:
+        self.stopSet = set(stopSequence)
+        self.nextStops = {}
+        for i in range(len(stopSequence) - 1, -1, -1):
+            self.nextStops[stopSequence[i]] = stopSequence[(i + 1) % len(stopSequence)]
+        self.nextThroughputs = {}
 
     
     def __eq__(self, another):
@@ -100,7 +229,127 @@ class Route:
 
     def getNextStop(self, currentStopID):
         ''' This method gets the next stop's ID when current stop's ID is given'''
-        return self.stopSequence[(self.stopSequence.index(currentStopID) + 1) % len(self.stopSequence)]
+        return self.nextStops[currentStopID]
+
+
+    def setThroughputs(self, roads):
+        ''' This method looks up the throughput of the road that leaves every stop of the route'''
+        self.nextThroughputs = {}
+        for (stopID, nextStopID) in self.nextStops.items():
+            if (stopID, nextStopID) in roads:
+                self.nextThroughputs[stopID] = roads[(stopID, nextStopID)]
+
+        
+class SumTree:
+    ''' A class representing a binary tree of weighted items. Every inner node holds
+    the sum of the weights below it, so the total weight and a weighted random pick
+    both take O(log n) time'''
+    def __init__(self):
+        self.capacity = 1
+        self.weights = [0.0, 0.0]
+        self.items = [None]
+        self.slots = {}
+        self.free = [0]
+
+
+    def __len__(self):
+        return len(self.slots)
+
+
+    def total(self):
+        ''' This method gets the total weight of the items in the tree'''
+        return self.weights[1]
+
+
+    def getItems(self):
+        ''' This method gets all of the items that are in the tree'''
+        return [self.items[slot] for slot in sorted(self.slots.values())]
+
+
+    def add(self, key, item, weight):
+        ''' This method adds an item with the given key and weight to the tree'''
+        if not self.free:
+            self.grow()
+        slot = self.free.pop()
+        self.slots[key] = slot
+        self.items[slot] = item
+        self.setWeight(slot, weight)
+
+
+    def remove(self, key):
+        ''' This method removes the item with the given key and returns it'''
+        slot = self.slots.pop(key)
+        item = self.items[slot]
+        self.items[slot] = None
+        self.setWeight(slot, 0.0)
+        self.free.append(slot)
+        return item
+
+
+    def update(self, key, weight):
+        ''' This method changes the weight of the item with the given key'''
+        self.setWeight(self.slots[key], weight)
+
+
+    def sample(self, value):
+        ''' This method gets the item at the given position (between 0 and the total
+        weight) when the items are laid out one after another by their weights'''
+        return self.find(value)[0]
+
+
+    def find(self, value):
+        ''' This method gets the item at the given position, as the sample method does,
+        and the position within the weight of that item'''
+        node = 1
+        while node < self.capacity:
+            node *= 2
+            # Rounding errors must not lead us into an empty subtree:
+            if not (value < self.weights[node]) and self.weights[node + 1] > 0:
+                value -= self.weights[node]
+                node += 1
+        return (self.items[node - self.capacity], value)
+
+
+    def setWeight(self, slot, weight):
+        ''' This method sets the weight of a leaf and recalculates the sums above it'''
+        node = slot + self.capacity
+        self.weights[node] = weight
+        node /= 2
+        while node >= 1:
+            self.weights[node] = self.weights[2 * node] + self.weights[2 * node + 1]
+            node /= 2
+
+
+    def getLayout(self):
+        ''' This method gets the slots of the items and the free slots, which decide
+        where in the tree the items are and where the next ones will go'''
+        return (self.capacity, dict(self.slots), list(self.free))
+
+
+    def setLayout(self, layout, items, weights):
+        ''' This method rebuilds the tree with the given layout. The items and their
+        weights are given in dicts by their keys'''
+        (self.capacity, slots, free) = layout
+        self.slots = dict(slots)
+        self.free = list(free)
+        self.items = [None] * self.capacity
+        self.weights = [0.0] * (2 * self.capacity)
+        for (key, slot) in self.slots.items():
+            self.items[slot] = items[key]
+            self.weights[self.capacity + slot] = weights[key]
+        for node in range(self.capacity - 1, 0, -1):
+            self.weights[node] = self.weights[2 * node] + self.weights[2 * node + 1]
+
+
+    def grow(self):
+        ''' This method doubles the number of leaves in the tree'''
+        leaves = self.weights[self.capacity:]
+        self.free = range(2 * self.capacity - 1, self.capacity - 1, -1)
+        self.items += [None] * self.capacity
+        self.capacity *= 2
+        self.weights = [0.0] * self.capacity + leaves + [0.0] * len(leaves)
+        for node in range(self.capacity - 1, 0, -1):
+            self.weights[node] = self.weights[2 * node] + self.weights[2 * node + 1]
 
         
 class Network:
@@ -110,13 +359,69 @@ class Network:
         self.stops = {}
         self.roads = {}
         self.params = {}
-        #Uncomment the following line in order to make the simulation deterministic(ish)
-        #random.seed(0)
+        # The sink that the events are reported to (stdout by default):
+        self.eventSink = Events.TextSink()
+        # The kind of container that stops and buses keep their passengers in:
+        self.passengerStorage = PassengerList
+        # Possible events, kept up to date by updateStopEvents:
+        self.paxRTB = {}
+        self.paxRTD = {}
+        self.busesRTD = {}
+        self.busesRTA = SumTree()
+        # The stops weighted by their number of each kind of event, so that picking one is O(log n):
+        self.paxRTBStops = SumTree()
+        self.paxRTDStops = SumTree()
+        self.busesRTDStops = SumTree()
+        # Running totals of the possible events:
+        self.totalPaxRTB = 0
+        self.totalPaxRTD = 0
+        self.totalBusesRTD = 0
+        # The IDs of stops whose events changed; only collected when this is a set:
+        self.changedStops = None
+        # Pre-drawn (origin, destination) pairs of the next new passengers, in reverse order:
+        self.arrivalBlockSize = 1
+        self.arrivals = []
+        self.stopIDs = None
+        # The streams that the random numbers are taken from: one for picking the events and one
+        # for every kind of event. Every simulation run gets new ones; usually they are all the
+        # same stream, which is seeded if the input file has a 'seed' line:
+        self.setRandomStream(RandomStreams.RandomStream(blockSize=1))
         
     
     def __eq__(self, another):
         return ((self.routes == another.routes) and (self.stops == another.stops) and (self.roads == another.roads))
     
+    def setRandomStream(self, rng):
+        ''' Method that makes all of the random numbers be taken from the given stream'''
+        self.rng = rng
+        self.arrivalRng = rng
+        self.boardRng = rng
+        self.disembarkRng = rng
+        self.departRng = rng
+        self.arriveRng = rng
+
+
+    def setCommonRandomStreams(self, seed, blockSize):
+        ''' Method that gives the picking of events and every kind of event its own stream, seeded
+        from the given seed. Runs with the same seed then use the same random numbers for the same
+        purposes (e.g. the same new passengers), even if their parameters are different'''
+        master = random.Random(seed)
+        streams = [RandomStreams.RandomStream(master.getrandbits(32), blockSize) for i in range(6)]
+        (self.rng, self.arrivalRng, self.boardRng, self.disembarkRng, self.departRng, self.arriveRng) = streams
+        self.clearArrivals()
+
+
+    def setPassengerStorage(self, passengerStorage):
+        ''' Method that makes all stops and buses keep their passengers in the given kind of
+        container: PassengerList (one by one) or PassengerGroups (grouped by destination)'''
+        self.passengerStorage = passengerStorage
+        for stop in self.stops.values():
+            stop.passengers = passengerStorage(stop.passengers)
+        for route in self.routes.values():
+            for bus in route.buses:
+                bus.passengers = passengerStorage(bus.passengers)
+
+
     def changeGeneralParams(self, paramDict):
         ''' Method that changes the given network parameters'''
         for key in paramDict:
@@ -126,6 +431,10 @@ class Network:
     def changeRoadParams(self, paramDict):
         ''' Method that changes the road params with those specified in the dictionary'''
         self.roads = paramDict
+        for route in self.routes.values():
+            route.setThroughputs(self.roads)
+        for (bus, route) in self.busesRTA.getItems():
+            self.busesRTA.update((bus.routeID, bus.busNumber), self.getThroughput(bus))
         
     
     def changeRouteParams(self, routeDict):
@@ -135,8 +444,130 @@ class Network:
                 self.routes[route['routeID']].getNewBus()
             for bus in self.routes[route['routeID']].buses:
                 bus.capacity = route['capacity']
+        self.updateAllEvents()
   
     
+    def snapshot(self):
+        ''' This method saves the state of the network as plain data (numbers, lists and dicts),
+        which is much cheaper to take than a deepcopy of the whole network'''
+        routes = []
+        for route in self.routes.values():
+            buses = [(bus.busNumber, bus.capacity, bus.status, bus.location,
+                      [pax.destStopID for pax in bus.passengers], bus.numberOfStops,
+                      bus.averagePassengersTravelling) for bus in route.buses]
+            routes.append((route.routeID, list(route.stopSequence), route.capacity, route.missedPassengers, buses))
+        stops = []
+        for stop in self.stops.values():
+            stops.append((stop.stopID, list(stop.reachableStops), [pax.destStopID for pax in stop.passengers],
+                          [(bus.routeID, bus.busNumber) for bus in stop.qOfBuses], stop.missedPassengers,
+                          stop.totalQueueingTime, stop.busQChangeTime, stop.numberOfBusesQueued))
+        return {'params' : dict(self.params),
+                'roads' : dict(self.roads),
+                'passengerStorage' : self.passengerStorage.__name__,
+                'routes' : routes,
+                'stops' : stops
+                }
+
+
+    def restore(self, snapshot):
+        ''' This method brings the network back to the state saved by the snapshot method'''
+        storage = {'PassengerList' : PassengerList, 'PassengerGroups' : PassengerGroups}[snapshot['passengerStorage']]
+        self.passengerStorage = storage
+        self.params = dict(snapshot['params'])
+        self.roads = dict(snapshot['roads'])
+        # Rebuilding routes and their buses:
+        self.routes = {}
+        buses = {}
+        for (routeID, stopSequence, capacity, missedPassengers, busStates) in snapshot['routes']:
+            route = Route(list(stopSequence), routeID, capacity)
+            route.missedPassengers = missedPassengers
+            route.setThroughputs(self.roads)
+            for (busNumber, busCapacity, status, location, passengers, numberOfStops, averagePassengers) in busStates:
+                bus = Bus(routeID, busNumber, busCapacity, location)
+                bus.status = status
+                bus.passengers = storage([Passenger(destStopID) for destStopID in passengers])
+                bus.numberOfStops = numberOfStops
+                bus.averagePassengersTravelling = averagePassengers
+                route.addBus(bus)
+                buses[(routeID, busNumber)] = bus
+            self.routes[routeID] = route
+        # Rebuilding stops and their bus queues:
+        self.stops = {}
+        for (stopID, reachableStops, passengers, qOfBuses, missedPassengers, totalQueueingTime,
+             busQChangeTime, numberOfBusesQueued) in snapshot['stops']:
+            stop = Stop(stopID)
+            stop.reachableStops = list(reachableStops)
+            stop.passengers = storage([Passenger(destStopID) for destStopID in passengers])
+            stop.qOfBuses = [buses[key] for key in qOfBuses]
+            stop.missedPassengers = missedPassengers
+            stop.totalQueueingTime = totalQueueingTime
+            stop.busQChangeTime = busQChangeTime
+            stop.numberOfBusesQueued = numberOfBusesQueued
+            self.stops[stopID] = stop
+        # Recalculating the possible events from scratch:
+        self.paxRTB = {}
+        self.paxRTD = {}
+        self.busesRTD = {}
+        self.totalPaxRTB = 0
+        self.totalPaxRTD = 0
+        self.totalBusesRTD = 0
+        self.indexStops()
+        self.updateAllEvents()
+        self.clearArrivals()
+
+
+    def getState(self):
+        ''' This method saves everything that the rest of a simulation run depends on: the
+        snapshot of the network, the layouts of the trees that the stops and the moving buses
+        are picked from, the random streams and the pre-drawn new passengers. A network
+        brought back to this state carries on exactly as this one would'''
+        state = self.snapshot()
+        state['busesRTA'] = self.busesRTA.getLayout()
+        # The rebuilt stops dict may go through the stops in another order, so the stop trees are saved too:
+        state['paxRTBStops'] = self.paxRTBStops.getLayout()
+        state['paxRTDStops'] = self.paxRTDStops.getLayout()
+        state['busesRTDStops'] = self.busesRTDStops.getLayout()
+        state.update(self.getRandomState())
+        return state
+
+
+    def getRandomState(self):
+        ''' This method saves the random streams of the network and the new passengers
+        drawn from them'''
+        return {'streams' : (self.rng, self.arrivalRng, self.boardRng, self.disembarkRng, self.departRng, self.arriveRng),
+                'randomState' : random.getstate(),
+                'arrivals' : list(self.arrivals),
+                'stopIDs' : self.stopIDs
+                }
+
+
+    def setState(self, state):
+        ''' This method brings the network back to the state saved by the getState method'''
+        self.restore(state)
+        items = {}
+        weights = {}
+        for route in self.routes.values():
+            for bus in route.buses:
+                if bus.status == 'Moving':
+                    items[(bus.routeID, bus.busNumber)] = (bus, route)
+                    weights[(bus.routeID, bus.busNumber)] = self.getThroughput(bus)
+        self.busesRTA.setLayout(state['busesRTA'], items, weights)
+        busesRTD = dict([(stopID, len(buses)) for (stopID, buses) in self.busesRTD.items()])
+        self.paxRTBStops.setLayout(state['paxRTBStops'], self.stops, self.paxRTB)
+        self.paxRTDStops.setLayout(state['paxRTDStops'], self.stops, self.paxRTD)
+        self.busesRTDStops.setLayout(state['busesRTDStops'], self.stops, busesRTD)
+        self.setRandomState(state)
+
+
+    def setRandomState(self, state):
+        ''' This method brings back the random streams and the new passengers saved by the
+        getRandomState method. The streams are copied, so the state can be used again'''
+        (self.rng, self.arrivalRng, self.boardRng, self.disembarkRng, self.departRng, self.arriveRng) = deepcopy(state['streams'])
+        random.setstate(state['randomState'])
+        self.arrivals = list(state['arrivals'])
+        self.stopIDs = state['stopIDs']
+
+
     def finishTakingStatistics(self, stopTime):
         ''' This method goes through all stops and makes them finish counting the bus queueing statistics'''
         for stop in self.stops.values():
@@ -149,6 +580,7 @@ class Network:
         for i in stopIDs:
             if not (i in self.stops.keys()):
                 self.stops[i] = Stop(i)
+                self.stops[i].passengers = self.passengerStorage()
             self.stops[i].addReachableStops(stopIDs)
         # Adding new route:
         if routeID in self.routes:
@@ -158,142 +590,299 @@ class Network:
         # Adding buses to the route:
         for i in range(0, busCount):
             bus = self.routes[routeID].getNewBus()
+            bus.passengers = self.passengerStorage()
             self.routes[routeID].addBus(bus)
             self.stops[bus.location].addBus(bus)
+        for i in stopIDs:
+            self.updateStopEvents(self.stops[i])
+        self.clearArrivals()
 
     
     def addPassenger(self, time, outputEvent):
         ''' This method adds a passenger to the bus network'''
-        originID = self.stops.keys()[random.randint(0, len(self.stops)-1)]
-        destID = random.choice(self.stops[originID].reachableStops)
-        self.stops[originID].passengers.append(Passenger(destID))
-        if outputEvent:
-            print 'A new passenger enters at stop {0} with destination {1} at time {2}'.format(originID, destID, time)
+        self.addPassengers(1, time, outputEvent)
+
+
+    def addPassengers(self, count, time, outputEvent):
+        ''' This method adds the given number of passengers to the bus network.
+        The events of every stop that got new passengers are recalculated only once'''
+        changed = set()
+        for i in range(count):
+            if not self.arrivals:
+                self.drawArrivals()
+            (originID, destID) = self.arrivals.pop()
+            origin = self.stops[originID]
+            origin.passengers.append(Passenger(destID))
+            # Without queueing buses a new passenger doesn't make any new events possible:
+            if origin.qOfBuses:
+                changed.add(originID)
+            if outputEvent:
+                self.eventSink.event(time, Events.NEW_PASSENGER, -1, -1, originID, destID)
+        for stopID in changed:
+            self.updateStopEvents(self.stops[stopID])
 
     
+    def clearArrivals(self):
+        ''' This method throws away the pre-drawn new passengers. It has to be called
+        every time the stops or the stops reachable from them change'''
+        self.arrivals = []
+        self.stopIDs = None
+
+
+    def drawArrivals(self):
+        ''' This method draws the origins and destinations of the next arrivalBlockSize new
+        passengers. The origin is a random stop and the destination is a random stop reachable
+        from it. Large blocks are turned into stops with NumPy if it is available'''
+        if self.stopIDs is None:
+            self.stopIDs = self.stops.keys()
+        stopIDs = self.stopIDs
+        size = self.arrivalBlockSize
+        if (numpy is not None) and (size > 1):
+            draws = numpy.asarray(self.arrivalRng.randomBlock(2 * size))
+            reachable = numpy.array([len(self.stops[stopID].reachableStops) for stopID in stopIDs])
+            origins = (draws[:size] * len(stopIDs)).astype(int)
+            destinations = (draws[size:] * reachable[origins]).astype(int)
+            arrivals = []
+            for (origin, destination) in zip(origins.tolist(), destinations.tolist()):
+                arrivals.append((stopIDs[origin], self.stops[stopIDs[origin]].reachableStops[destination]))
+        else:
+            arrivals = []
+            for i in range(size):
+                originID = stopIDs[self.arrivalRng.index(len(stopIDs))]
+                reachableStops = self.stops[originID].reachableStops
+                arrivals.append((originID, reachableStops[self.arrivalRng.index(len(reachableStops))]))
+        arrivals.reverse()
+        self.arrivals = arrivals
+
+
     def getThroughput(self, bus):
         ''' This method gets the throughput of the road segment
             that the bus is currently on '''
-        originStopID = bus.location
-        destinationStopID = self.routes[bus.routeID].getNextStop(originStopID)
-        return self.roads[(originStopID, destinationStopID)]
-        
-        
-    def getPaxRTB(self):
-        ''' This method gets all passengers that are in a stop, the bus
-        at the front of the bus queue suits them and is not full'''
-        paxRTB = []
-        for stop in self.stops.values():
-            if stop.qOfBuses:
-                firstBus = stop.qOfBuses[0]
-                if len(firstBus.passengers) < firstBus.capacity:
-                    for pax in stop.passengers:
-                        if (pax.destStopID in self.routes[firstBus.routeID].stopSequence):
-                            paxRTB.append((pax, firstBus))
-        return paxRTB
-
-
-    def getPaxRTD(self):
-        ''' This method gets all passengers that are in a bus, but would like
-        to get off the bus. Also, the bus is at a bus stop'''
-        paxRTD = []
-        for stop in self.stops.values():
-            for bus in stop.qOfBuses:
-                for pax in bus.passengers:
-                    if (pax.destStopID == bus.location) and (bus.status == 'Queueing'):
-                        paxRTD.append((pax, bus))
-        return paxRTD
+        return self.routes[bus.routeID].nextThroughputs[bus.location]
+
+
+    def getRouteStops(self, routeID):
+        ''' This method gets the set of stops that the given route goes through'''
+        return self.routes[routeID].stopSet
 
 
-    def getBusesRTD(self):
-        ''' This method gets all of the buses that are ready to depart from
-        the stop that they are located'''
+    def getNextStop(self, bus):
+        ''' This method gets the stop that the bus is going to after its current stop'''
+        return self.routes[bus.routeID].nextStops[bus.location]
+
+
+    def updateStopEvents(self, stop):
+        ''' This method recalculates the events that are possible at the given stop.
+        It has to be called every time the passengers or the bus queue of the stop change,
+        so that the rest of the network doesn't need to be rescanned'''
+        # Passengers that can board the bus at the front of the queue:
+        paxRTB = 0
+        if stop.qOfBuses:
+            firstBus = stop.qOfBuses[0]
+            if len(firstBus.passengers) < firstBus.capacity:
+                paxRTB = stop.passengers.countFor(self.getRouteStops(firstBus.routeID))
+        # Passengers that want to get off and buses that have nothing left to do:
+        paxRTD = 0
         busesRTD = []
-        for stop in self.stops.values():
-            for bus in stop.qOfBuses:
-                noneToDisembark = True
-                noneToBoard = True
-                # Checking if there is any passenger that wants to get onboard:
+        waiting = {}
+        for bus in stop.qOfBuses:
+            disembarking = bus.passengers.countTo(stop.stopID)
+            paxRTD += disembarking
+            if disembarking == 0:
                 if len(bus.passengers) < bus.capacity:
-                    for pax in stop.passengers:
-                        if (pax.destStopID in self.routes[bus.routeID].stopSequence):
-                            noneToBoard = False
-                            break
-                # Checking if there is any passenger that wants to disembark:
-                if noneToBoard:
-                    for pax in bus.passengers:
-                        if (pax.destStopID == bus.location) and (bus.status == 'Queueing'):
-                            noneToDisembark = False
-                            break
-                    if noneToBoard and noneToDisembark:
-                        busesRTD.append((bus, stop))
-        return busesRTD
+                    if not (bus.routeID in waiting):
+                        waiting[bus.routeID] = stop.passengers.countFor(self.getRouteStops(bus.routeID))
+                    if waiting[bus.routeID] > 0:
+                        continue
+                busesRTD.append(bus)
+        if not (stop.stopID in self.paxRTBStops.slots):
+            self.indexStops()
+        # The trees are only updated when the numbers change, which most events don't do:
+        previous = self.paxRTB.get(stop.stopID, 0)
+        if paxRTB != previous:
+            self.totalPaxRTB += paxRTB - previous
+            self.paxRTBStops.update(stop.stopID, paxRTB)
+        previous = self.paxRTD.get(stop.stopID, 0)
+        if paxRTD != previous:
+            self.totalPaxRTD += paxRTD - previous
+            self.paxRTDStops.update(stop.stopID, paxRTD)
+        previous = len(self.busesRTD.get(stop.stopID, []))
+        if len(busesRTD) != previous:
+            self.totalBusesRTD += len(busesRTD) - previous
+            self.busesRTDStops.update(stop.stopID, len(busesRTD))
+        self.paxRTB[stop.stopID] = paxRTB
+        self.paxRTD[stop.stopID] = paxRTD
+        self.busesRTD[stop.stopID] = busesRTD
+        if self.changedStops is not None:
+            self.changedStops.add(stop.stopID)
 
 
-    def getBusesRTA(self):
-        ''' This method gets all of the buses that are ready to arrive at
-        the stop that they are located at'''
-        busesRTA = []
+    def indexStops(self):
+        ''' This method rebuilds the trees that the stops are picked from. The stops are laid
+        out in the order of the stops dict, so the same random number picks the same stop as
+        going through the stops one by one would. It has to be called when stops are added'''
+        self.paxRTBStops = SumTree()
+        self.paxRTDStops = SumTree()
+        self.busesRTDStops = SumTree()
+        for stop in self.stops.values():
+            self.paxRTBStops.add(stop.stopID, stop, self.paxRTB.get(stop.stopID, 0))
+            self.paxRTDStops.add(stop.stopID, stop, self.paxRTD.get(stop.stopID, 0))
+            self.busesRTDStops.add(stop.stopID, stop, len(self.busesRTD.get(stop.stopID, [])))
+
+
+    def updateAllEvents(self):
+        ''' This method recalculates the possible events of the entire network'''
+        for stop in self.stops.values():
+            self.updateStopEvents(stop)
+        self.busesRTA = SumTree()
         for route in self.routes.values():
             for bus in route.buses:
                 if bus.status == 'Moving':
-                    busesRTA.append((bus, route))
-        return busesRTA
+                    self.busesRTA.add((bus.routeID, bus.busNumber), (bus, route), self.getThroughput(bus))
+
+
+    def pickStop(self, rng, stops, total):
+        ''' This method picks a random stop from the given tree, where every stop is
+        weighted by its number of events. It returns the stop and the index of the
+        chosen event within that stop. The random number is taken from rng'''
+        (stop, choice) = stops.find(rng.index(total))
+        return (stop, int(choice))
+        
+        
+    def getBusesRTA(self):
+        ''' This method gets all of the buses that are ready to arrive at
+        the stop that they are located at'''
+        return self.busesRTA.getItems()
 
     
     def boardPassenger(self, time, outputEvent):
         ''' This method adds a random passenger to the bus
         that he wishes to board'''
-        (rand_pax, rand_bus) = random.choice(self.getPaxRTB())
+        (stop, choice) = self.pickStop(self.boardRng, self.paxRTBStops, self.totalPaxRTB)
+        self.boardPassengerAt(stop, choice, time, outputEvent)
+
+
+    def boardPassengerAt(self, stop, index, time, outputEvent):
+        ''' This method boards the passenger with the given index (among the passengers that
+        can board) at the given stop to the bus at the front of the queue'''
+        rand_bus = stop.qOfBuses[0]
+        rand_pax = stop.passengers.takeFor(self.getRouteStops(rand_bus.routeID), index)
         rand_bus.passengers.append(rand_pax)
-        self.stops[rand_bus.location].passengers.pop(self.stops[rand_bus.location].passengers.index(rand_pax))
+        self.updateStopEvents(stop)
         if outputEvent:
-            print 'Passenger boards bus {0} at stop {1} with destination {2} at time {3}'.format(str(rand_bus.routeID) + '.' + str(rand_bus.busNumber), rand_bus.location, rand_pax.destStopID, time)
+            self.eventSink.event(time, Events.BOARD, rand_bus.routeID, rand_bus.busNumber, rand_bus.location, rand_pax.destStopID)
         
         
+    def boardPassengersAt(self, stop, count, time, outputEvent):
+        ''' This method boards up to the given number of random passengers at the given stop
+        to the bus at the front of the queue. It stops early if the bus gets full or there
+        is nobody left to board, and returns the number of passengers that boarded'''
+        rand_bus = stop.qOfBuses[0]
+        routeStops = self.getRouteStops(rand_bus.routeID)
+        waiting = self.paxRTB[stop.stopID]
+        boarded = 0
+        while (boarded < count) and (waiting > 0) and (len(rand_bus.passengers) < rand_bus.capacity):
+            rand_pax = stop.passengers.takeFor(routeStops, self.boardRng.index(waiting))
+            rand_bus.passengers.append(rand_pax)
+            waiting -= 1
+            boarded += 1
+            if outputEvent:
+                self.eventSink.event(time, Events.BOARD, rand_bus.routeID, rand_bus.busNumber, rand_bus.location, rand_pax.destStopID)
+        self.updateStopEvents(stop)
+        return boarded
+
+
     def disembarkPassenger(self, time, outputEvent):
         ''' This method disembarks a random passenger from the bus that he's in'''
-        (rand_pax, rand_bus) = random.choice(self.getPaxRTD())
-        rand_bus.passengers.pop(rand_bus.passengers.index(rand_pax))
+        (stop, choice) = self.pickStop(self.disembarkRng, self.paxRTDStops, self.totalPaxRTD)
+        self.disembarkPassengerAt(stop, choice, time, outputEvent)
+
+
+    def disembarkPassengerAt(self, stop, index, time, outputEvent):
+        ''' This method disembarks the passenger with the given index (among the passengers
+        that want to get off) from one of the buses queueing at the given stop'''
+        for rand_bus in stop.qOfBuses:
+            disembarking = rand_bus.passengers.countTo(stop.stopID)
+            if index < disembarking:
+                break
+            index -= disembarking
+        rand_bus.passengers.takeTo(stop.stopID)
+        self.updateStopEvents(stop)
         if outputEvent:
-            print 'Passenger disembarks bus {0} at stop {1} at time {2}'.format(str(rand_bus.routeID) + '.' + str(rand_bus.busNumber), rand_bus.location, time)
+            self.eventSink.event(time, Events.DISEMBARK, rand_bus.routeID, rand_bus.busNumber, rand_bus.location, stop.stopID)
         
 
+    def disembarkPassengersAt(self, stop, count, time, outputEvent):
+        ''' This method disembarks up to the given number of random passengers from the buses
+        queueing at the given stop and returns the number of passengers that got off'''
+        disembarking = [bus.passengers.countTo(stop.stopID) for bus in stop.qOfBuses]
+        remaining = sum(disembarking)
+        disembarked = 0
+        while (disembarked < count) and (remaining > 0):
+            index = self.disembarkRng.index(remaining)
+            for (position, rand_bus) in enumerate(stop.qOfBuses):
+                if index < disembarking[position]:
+                    break
+                index -= disembarking[position]
+            rand_bus.passengers.takeTo(stop.stopID)
+            disembarking[position] -= 1
+            remaining -= 1
+            disembarked += 1
+            if outputEvent:
+                self.eventSink.event(time, Events.DISEMBARK, rand_bus.routeID, rand_bus.busNumber, rand_bus.location, stop.stopID)
+        self.updateStopEvents(stop)
+        return disembarked
+
+
     def departBus(self, time, outputEvent):
         ''' This method departs a random bus that's ready to depart'''
-        (rand_bus, rand_stop) = random.choice(self.getBusesRTD())
+        (rand_stop, choice) = self.pickStop(self.departRng, self.busesRTDStops, self.totalBusesRTD)
+        self.departBusAt(rand_stop, choice, time, outputEvent)
+
+
+    def departBusAt(self, rand_stop, index, time, outputEvent):
+        ''' This method departs the bus with the given index (among the buses that are ready
+        to depart) from the given stop and returns the bus'''
+        rand_bus = self.busesRTD[rand_stop.stopID][index]
         busPositionInQ = rand_stop.qOfBuses.index(rand_bus)
         self.calculateQueueingTime(rand_stop, time)
         rand_stop.busQChangeTime = time
         rand_stop.qOfBuses.pop(busPositionInQ)
         rand_bus.status = 'Moving'
+        self.busesRTA.add((rand_bus.routeID, rand_bus.busNumber), (rand_bus, self.routes[rand_bus.routeID]), self.getThroughput(rand_bus))
         self.calculateMissedPassengers(rand_bus, rand_stop)
         self.calculateTravellingPassengers(rand_bus)
+        self.updateStopEvents(rand_stop)
         if outputEvent:
-            print 'Bus {0} leaves stop {1} at time {2}'.format(str(rand_bus.routeID) + '.' + str(rand_bus.busNumber), rand_bus.location, time)
+            self.eventSink.event(time, Events.DEPART, rand_bus.routeID, rand_bus.busNumber, rand_bus.location, -1)
+        return rand_bus
 
 
     def arriveBus(self, time, outputEvent):
-        ''' This method makes a random bus that's ready to arrive to arrive'''
-        (rand_bus, rand_route) = random.choice(self.getBusesRTA())
-        next_stop_id = rand_route.getNextStop(rand_bus.location)
+        ''' This method makes a random bus that's ready to arrive to arrive.
+        The bus is picked with the probability proportional to its road's throughput'''
+        (rand_bus, rand_route) = self.busesRTA.sample(self.arriveRng.random() * self.busesRTA.total())
+        self.arriveGivenBus(rand_bus, time, outputEvent)
+
+
+    def arriveGivenBus(self, rand_bus, time, outputEvent):
+        ''' This method makes the given moving bus arrive at its next stop'''
+        self.busesRTA.remove((rand_bus.routeID, rand_bus.busNumber))
+        next_stop_id = self.getNextStop(rand_bus)
         rand_bus.location = next_stop_id
         rand_bus.status = 'Queueing'
         self.calculateQueueingTime(self.stops[next_stop_id], time)
         self.stops[next_stop_id].qOfBuses.append(rand_bus)
         self.stops[next_stop_id].busQChangeTime = time
         self.stops[next_stop_id].numberOfBusesQueued += 1
+        self.updateStopEvents(self.stops[next_stop_id])
         if outputEvent:
-            print 'Bus {0} arrives at stop {1} at time {2}'.format(str(rand_bus.routeID) + '.' + str(rand_bus.busNumber), next_stop_id, time)
+            self.eventSink.event(time, Events.ARRIVE, rand_bus.routeID, rand_bus.busNumber, next_stop_id, -1)
             
             
     def calculateMissedPassengers(self, bus, stop):
         ''' This method calculates and adds the missed passengers to the stop and route'''
-        missed = 0
-        stopSequence = self.routes[bus.routeID].stopSequence
-        for pax in stop.passengers:
-            if (pax.destStopID in stopSequence):
-                missed += 1
+        missed = stop.passengers.countFor(self.getRouteStops(bus.routeID))
         stop.missedPassengers += missed
         self.routes[bus.routeID].missedPassengers += missed
         
@@ -0,0 +1,206 @@
+'''
+This file contains alternative parameter optimisers. The default optimiser is
+Simulation.executeOptimisation, which runs every parameter combination for the
+whole stop time. The optimisers here use the same cost: the number of missed
+passengers multiplied by the sum of the parameter values.
+
+Every optimiser is created with the simulation, the initial network snapshot and a pool
+of processes (or None); the search strategies also take the largest number of
+combinations they may evaluate (or None). Its optimise method takes the parameter
+combinations and returns the best one it found, and its evaluations attribute counts
+the simulated time in runs over the whole stop time, which for the search strategies
+is the number of combinations they simulated.
+'''
+import random
+from math import exp
+
+# The shortest horizon the combinations are raced for, as a fraction of the stop time:
+RACING_MIN_HORIZON = 1.0 / 16
+# The starting temperature of annealing, as a fraction of the cost of the starting combination:
+ANNEALING_START = 0.1
+# The temperature of annealing at the end of the budget, as a fraction of the starting one:
+ANNEALING_END = 0.001
+
+
+class RacingOptimiser(object):
+    ''' A class that picks the best parameter combination by racing the combinations. All of
+    them are run for a short horizon, the worst of them are dropped and the rest are run again
+    for twice as long, until the last round is run for the whole stop time and only the best
+    combination is left. The number of combinations shrinks by the same factor every round.
+    Ties go to the combination that comes first, as in the default optimiser'''
+    def __init__(self, simulation, initialNetwork, pool=None):
+        self.simulation = simulation
+        self.initialNetwork = initialNetwork
+        self.pool = pool
+        self.evaluations = 0
+
+
+    def getHorizons(self, count):
+        ''' Method that gets the horizon of every round for the given number of combinations.
+        There are as many rounds as halvings needed to get to one combination, but the
+        horizons never go below the shortest one. The runs that start from a saved state
+        are raced for the time after it'''
+        startTime = self.simulation.getStartTime()
+        length = self.simulation.params['control']['stopTime'] - startTime
+        rounds = 0
+        while 2**rounds < count:
+            rounds += 1
+        lengths = [length / 2**i for i in range(rounds)]
+        lengths.reverse()
+        return [startTime + part for part in lengths if part >= length * RACING_MIN_HORIZON]
+
+
+    def getCosts(self, combinations, horizon):
+        ''' Method that gets the costs of the given combinations run for the given horizon.
+        A run for a part of the stop time only counts as that part of an evaluation'''
+        startTime = self.simulation.getStartTime()
+        length = self.simulation.params['control']['stopTime'] - startTime
+        self.evaluations += len(combinations) * (horizon - startTime) / length
+        return self.simulation.getCombinationCosts(self.initialNetwork, combinations, horizon, self.pool)
+
+
+    def optimise(self, combinations):
+        ''' Method that races the given combinations and returns the best one'''
+        candidates = list(enumerate(combinations))
+        count = len(candidates)
+        horizons = self.getHorizons(count)
+        for (i, horizon) in enumerate(horizons):
+            costs = self.getCosts([combination for (index, combination) in candidates], horizon)
+            survivors = int(round(count ** (float(len(horizons) - i - 1) / len(horizons))))
+            ranking = sorted(zip(costs, candidates))
+            candidates = sorted([candidate for (cost, candidate) in ranking[:survivors]])
+        return candidates[0][1]
+
+
+
+class SearchStrategy(object):
+    ''' A class that the search strategies are based on. Instead of going through the
+    combinations, a search moves between points of the parameter space. A point holds the
+    index of the value of every parameter with more than one experimentation value, and its
+    neighbours differ from it by one step in one of the parameters. Every point is simulated
+    at most once, and no more than the budget of points are simulated'''
+    def __init__(self, simulation, initialNetwork, pool=None, budget=None):
+        self.simulation = simulation
+        self.initialNetwork = initialNetwork
+        self.pool = pool
+        self.budget = budget
+        self.evaluations = 0
+        self.dimensions = simulation.getParameterDimensions()
+        self.size = 1
+        for (kind, key, values) in self.dimensions:
+            self.size *= len(values)
+        if budget is None:
+            self.budget = self.size
+        self.costs = {}
+        self.best = None
+        self.random = random.Random(simulation.params['control'].get('seed'))
+
+
+    def getCosts(self, points):
+        ''' Method that gets the costs of the given points. The points that weren't simulated
+        yet are simulated together, in the pool of processes if there is one'''
+        newPoints = []
+        for point in points:
+            if not (point in self.costs) and not (point in newPoints):
+                newPoints.append(point)
+        combinations = [self.simulation.getParamCombination(self.dimensions, point) for point in newPoints]
+        costs = self.simulation.getCombinationCosts(self.initialNetwork, combinations, None, self.pool)
+        self.evaluations += len(newPoints)
+        for (point, cost) in zip(newPoints, costs):
+            self.costs[point] = cost
+            if (self.best is None) or (cost < self.costs[self.best]):
+                self.best = point
+        return [self.costs[point] for point in points]
+
+
+    def getRemainingBudget(self):
+        ''' Method that gets the number of points that can still be simulated'''
+        return min(self.budget, self.size) - self.evaluations
+
+
+    def isFinished(self):
+        ''' Method that checks if the search has to stop. It stops when the budget is spent
+        or when a combination that misses no passengers is found, as none can beat it'''
+        return (self.getRemainingBudget() <= 0) or (self.best is not None and self.costs[self.best] == 0)
+
+
+    def getRandomPoint(self):
+        ''' Method that gets a random point that wasn't simulated yet'''
+        while True:
+            point = tuple([self.random.randrange(len(values)) for (kind, key, values) in self.dimensions])
+            if not (point in self.costs):
+                return point
+
+
+    def getNeighbours(self, point):
+        ''' Method that gets the neighbours of the given point'''
+        neighbours = []
+        for (i, (kind, key, values)) in enumerate(self.dimensions):
+            for step in [-1, 1]:
+                if 0 <= point[i] + step < len(values):
+                    neighbours.append(point[:i] + (point[i] + step,) + point[i + 1:])
+        return neighbours
+
+
+    def getBestCombination(self):
+        ''' Method that gets the best combination found by the search'''
+        if self.best is None:
+            return next(self.simulation.generateParamCombinations())
+        return self.simulation.getParamCombination(self.dimensions, self.best)
+
+
+
+class LocalSearchOptimiser(SearchStrategy):
+    ''' A class that searches the parameters by steepest descent. All of the neighbours of
+    the current point are simulated and the search moves to the best of them, until none of
+    them is better. Then it starts again from a random point, until the budget is spent'''
+    def optimise(self, combinations):
+        ''' Method that searches for the best combination and returns it'''
+        point = self.getRandomPoint()
+        cost = self.getCosts([point])[0]
+        while not self.isFinished():
+            neighbours = [neighbour for neighbour in self.getNeighbours(point) if not (neighbour in self.costs)]
+            self.random.shuffle(neighbours)
+            neighbours = neighbours[:self.getRemainingBudget()]
+            moved = False
+            for (neighbourCost, neighbour) in sorted(zip(self.getCosts(neighbours), neighbours))[:1]:
+                if neighbourCost < cost:
+                    (cost, point, moved) = (neighbourCost, neighbour, True)
+            if not moved and not self.isFinished():
+                point = self.getRandomPoint()
+                cost = self.getCosts([point])[0]
+        return self.getBestCombination()
+
+
+
+class AnnealingOptimiser(SearchStrategy):
+    ''' A class that searches the parameters by simulated annealing. The search moves to a
+    random neighbour of the current point if it is better, and otherwise with a probability
+    that falls as the neighbour gets worse and as the temperature goes down. The temperature
+    falls from a fraction of the starting cost to almost nothing as the budget is spent'''
+    def optimise(self, combinations):
+        ''' Method that searches for the best combination and returns it'''
+        point = self.getRandomPoint()
+        cost = self.getCosts([point])[0]
+        startTemperature = ANNEALING_START * cost
+        budget = min(self.budget, self.size)
+        steps = 0
+        # The revisited points cost nothing, so the number of steps is limited too:
+        while not self.isFinished() and (steps < budget * 100):
+            steps += 1
+            neighbours = self.getNeighbours(point)
+            if not neighbours:
+                break
+            neighbour = neighbours[self.random.randrange(len(neighbours))]
+            neighbourCost = self.getCosts([neighbour])[0]
+            temperature = startTemperature * ANNEALING_END ** (float(self.evaluations) / budget)
+            if (neighbourCost <= cost) or (self.random.random() < exp((cost - neighbourCost) / temperature)):
+                (cost, point) = (neighbourCost, neighbour)
+        return self.getBestCombination()
+
+
+
+# The optimisers that can be chosen in the input file:
+OPTIMISERS = {'racing' : RacingOptimiser,
+              'local search' : LocalSearchOptimiser,
+              'annealing' : AnnealingOptimiser}
@@ -74,6 +74,81 @@ class Parser:
                     raise Exception("The stop time can be specified only once per input file!")
                 match = re.match('stop\stime\s((0|[1-9][0-9]*)\.[0-9]+)$', line)
                 simulation.params['control']['stopTime'] = float(match.group(1))
+            elif line.startswith('workers'):
+                if 'workers' in simulation.params['control']:
+                    raise Exception("The number of workers can be specified only once per input file!")
+                match = re.match('workers\s([1-9][0-9]*)$', line)
+                simulation.params['control']['workers'] = int(match.group(1))
+            elif line.startswith('event file'):
+                if 'eventFile' in simulation.params['control']:
+                    raise Exception("The event file can be specified only once per input file!")
+                match = re.match('event\sfile\s(\S+)$', line)
+                simulation.params['control']['eventFile'] = match.group(1)
+            elif line.startswith('trace file'):
+                if 'traceFile' in simulation.params['control']:
+                    raise Exception("The trace file can be specified only once per input file!")
+                match = re.match('trace\sfile\s(\S+)$', line)
+                simulation.params['control']['traceFile'] = match.group(1)
+            elif line.startswith('cache file'):
+                if 'cacheFile' in simulation.params['control']:
+                    raise Exception("The cache file can be specified only once per input file!")
+                match = re.match('cache\sfile\s(\S+)$', line)
+                simulation.params['control']['cacheFile'] = match.group(1)
+            elif line.startswith('checkpoint file'):
+                if 'checkpointFile' in simulation.params['control']:
+                    raise Exception("The checkpoint file can be specified only once per input file!")
+                match = re.match('checkpoint\sfile\s(\S+)$', line)
+                simulation.params['control']['checkpointFile'] = match.group(1)
+            elif line.startswith('save state'):
+                if 'saveStateFile' in simulation.params['control']:
+                    raise Exception("The state can be saved only once per input file!")
+                match = re.match('save\sstate\s(\S+)\sat\s((0|[1-9][0-9]*)\.[0-9]+)$', line)
+                simulation.params['control']['saveStateFile'] = match.group(1)
+                simulation.params['control']['saveStateTime'] = float(match.group(2))
+            elif line.startswith('load state'):
+                if 'loadStateFile' in simulation.params['control']:
+                    raise Exception("The state can be loaded only once per input file!")
+                match = re.match('load\sstate\s(\S+)$', line)
+                simulation.params['control']['loadStateFile'] = match.group(1)
+            elif line.startswith('seed'):
+                if 'seed' in simulation.params['control']:
+                    raise Exception("The seed can be specified only once per input file!")
+                match = re.match('seed\s(0|[1-9][0-9]*)$', line)
+                simulation.params['control']['seed'] = int(match.group(1))
+            elif line.startswith('replications'):
+                if 'replications' in simulation.params['control']:
+                    raise Exception("The number of replications can be specified only once per input file!")
+                match = re.match('replications\s([1-9][0-9]*)$', line)
+                simulation.params['control']['replications'] = int(match.group(1))
+            elif line.startswith('precision'):
+                if 'precision' in simulation.params['control']:
+                    raise Exception("The precision can be specified only once per input file!")
+                match = re.match('precision\s((0|[1-9][0-9]*)\.[0-9]+)$', line)
+                simulation.params['control']['precision'] = float(match.group(1))
+            elif line.startswith('engine'):
+                if 'engine' in simulation.params['control']:
+                    raise Exception("The engine can be specified only once per input file!")
+                if 'vectorised' in line:
+                    match = re.match('engine\s(vectorised)$', line)
+                    simulation.params['control']['engine'] = match.group(1)
+                elif 'tau leaping' in line:
+                    match = re.match('engine\stau\sleaping\s((0|[1-9][0-9]*)\.[0-9]+)$', line)
+                    if float(match.group(1)) <= 0:
+                        raise Exception("The leap of the tau leaping engine has to be positive!")
+                    simulation.params['control']['tau'] = float(match.group(1))
+                    simulation.params['control']['engine'] = 'tau leaping'
+                else:
+                    match = re.match('engine\s(next\sreaction)$', line)
+                    simulation.params['control']['engine'] = match.group(1)
+            elif line.startswith('optimiser'):
+                if 'optimiser' in simulation.params['control']:
+                    raise Exception("The optimiser can be specified only once per input file!")
+                if 'racing' in line:
+                    match = re.match('optimiser\s(racing)$', line)
+                else:
+                    match = re.match('optimiser\s(local\ssearch|annealing)\s([1-9][0-9]*)$', line)
+                    simulation.params['control']['budget'] = int(match.group(2))
+                simulation.params['control']['optimiser'] = match.group(1)
             elif line == 'ignore warnings':
                 if simulation.params['control']['ignoreWarnings']:
                     raise Exception("Ignore warnings flag can be specified only once per input file!")
@@ -82,6 +157,14 @@ class Parser:
                 if simulation.params['control']['optimiseParameters']:
                     raise Exception("Optimise parameters flag can be specified only once per input file!")
                 simulation.params['control']['optimiseParameters'] = True
+            elif line == 'group passengers':
+                if simulation.params['control']['groupPassengers']:
+                    raise Exception("Group passengers flag can be specified only once per input file!")
+                simulation.params['control']['groupPassengers'] = True
+            elif line == 'common random numbers':
+                if simulation.params['control']['commonRandomNumbers']:
+                    raise Exception("Common random numbers flag can be specified only once per input file!")
+                simulation.params['control']['commonRandomNumbers'] = True
             # Parsing arguments that affect the network object:
             elif line.startswith('route'):
                 match = re.search('route\s(0|[1-9][0-9]*)\sstops((\s(0|[1-9][0-9]*))+)\sbuses\s(experiment((\s(0|[1-9][0-9]*))+)|(0|[1-9][0-9]*))\scapacity\s(experiment((\s(0|[1-9][0-9]*))+)|(0|[1-9][0-9]*))$', line)
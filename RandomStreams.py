@@ -0,0 +1,82 @@
+'''
+This file contains the random number stream that the simulation draws its random
+numbers from. The numbers are drawn in large blocks and handed out one by one, so
+the simulation loop doesn't have to call the random module on every step.
+'''
+import random
+from math import log10
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RandomStream(object):
+    ''' A class representing a stream of random numbers. A stream without a seed takes its
+    numbers from the random module. Blocks are drawn with NumPy if it is available, using a
+    generator that is seeded from the stream's own one'''
+    def __init__(self, seed=None, blockSize=4096):
+        self.generator = None if seed is None else random.Random(seed)
+        self.blockSize = blockSize
+        self.numpyRandom = None
+        # The drawn numbers are handed out from the end of the lists:
+        self.uniforms = []
+        self.exponentials = []
+
+
+    def getGenerator(self):
+        ''' Method that gets the generator that the stream draws its numbers from'''
+        return random if self.generator is None else self.generator
+
+
+    def getNumpyRandom(self):
+        ''' Method that gets the NumPy generator of the stream, creating it if needed'''
+        if numpy is None:
+            raise Exception('NumPy is not installed')
+        if self.numpyRandom is None:
+            self.numpyRandom = numpy.random.RandomState(self.getGenerator().getrandbits(32))
+        return self.numpyRandom
+
+
+    def randomBlock(self, size):
+        ''' Method that draws the given number of uniform random numbers from [0, 1).
+        It returns a NumPy array if NumPy is available and a list otherwise'''
+        if (numpy is not None) and (size > 1):
+            return self.getNumpyRandom().random_sample(size)
+        generator = self.getGenerator()
+        return [generator.random() for i in range(size)]
+
+
+    def random(self):
+        ''' Method that gets a uniform random number from [0, 1)'''
+        if not self.uniforms:
+            block = self.randomBlock(self.blockSize)
+            if not isinstance(block, list):
+                block = block.tolist()
+            block.reverse()
+            self.uniforms = block
+        return self.uniforms.pop()
+
+
+    def index(self, size):
+        ''' Method that gets a random index into a sequence of the given size'''
+        return int(self.random() * size)
+
+
+    def exponential(self):
+        ''' Method that gets the delay until an event with the rate of one happens. As in the
+        rest of the simulation, the delay is -log10(u), so it has to be divided by the rate'''
+        if not self.exponentials:
+            block = self.randomBlock(self.blockSize)
+            if not isinstance(block, list):
+                block = (-numpy.log10(1.0 - block)).tolist()
+            else:
+                block = [-log10(1.0 - u) for u in block]
+            block.reverse()
+            self.exponentials = block
+        return self.exponentials.pop()
+
+
+    def gauss(self, mu, sigma):
+        ''' Method that gets a normally distributed random number'''
+        return self.getGenerator().gauss(mu, sigma)
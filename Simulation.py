@@ -4,11 +4,40 @@ passenger and bus movement/queueing in the network
 '''
 import Parser
 import Models
+import Events
+import Trace
+import Engines
+import Optimisers
+import RandomStreams
+import Cache
+import Checkpoints
 import warnings
-from random import uniform
-from math import log10
-from copy import deepcopy
+import random
 import itertools
+import multiprocessing
+import cPickle
+import gzip
+import hashlib
+import StringIO
+import signal
+
+# The number of new passengers whose origins and destinations are drawn at once:
+ARRIVAL_BLOCK_SIZE = 256
+# The number of random numbers that are drawn at once:
+RANDOM_BLOCK_SIZE = 1024
+# The most replications that are run while waiting for the confidence intervals to narrow:
+MAX_REPLICATIONS = 10000
+# The half-width of a confidence interval that is always precise enough, for statistics with means close to 0:
+MIN_HALF_WIDTH = 0.001
+# The values of Student's t distribution for 95% confidence intervals, by degrees of freedom:
+T_VALUES = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+            2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+            2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+# The values of Student's t distribution for 95% confidence intervals past 30 degrees of freedom,
+# from the same standard tables. The one for infinitely many is the normal distribution's 1.960:
+LARGE_T_VALUES = [(30, 2.042), (40, 2.021), (60, 2.000), (120, 1.980)]
+# The statistics of the entire network, which have to reach the requested precision:
+NETWORK_STATISTICS = ['number of missed passengers', 'average passengers', 'average queueing at all stops']
 
 
 class Simulation:
@@ -24,10 +53,17 @@ class Simulation:
         self.params['control']['ignoreWarnings'] = False
         self.params['control']['optimiseParameters'] = False
         self.params['control']['experimentation'] = False
+        self.params['control']['groupPassengers'] = False
+        self.params['control']['commonRandomNumbers'] = False
         self.params['general']['board'] = []
         self.params['general']['disembarks'] = []
         self.params['general']['departs'] = []
         self.params['general']['new passengers'] = []
+        self.cache = None
+        self.checkpoint = None
+        # The saved state that the runs start from, if there is one, and the hash of its file:
+        self.startState = None
+        self.startStateKey = None
 
 
     def __eq__(self, another):
@@ -54,127 +90,511 @@ class Simulation:
 
 
     def generateRouteSets(self):
-        ''' This method generates all possible route experimental value combinations'''
+        ''' This method generates all possible route experimental value combinations one by one'''
         route_product = []
         for route in self.params['routes'].values():
-            product = [x for x in apply(itertools.product, route.values())]
-            route_product.append([dict(zip(route.keys(), p)) for p in product])
-        return [list(set) for set in apply(itertools.product, route_product)]
+            route_product.append([dict(zip(route.keys(), p)) for p in apply(itertools.product, route.values())])
+        for set in apply(itertools.product, route_product):
+            yield list(set)
         
 
     def generateRoadSets(self):
-        ''' This method generates all possible route throughput rate combinations'''
-        product = [x for x in apply(itertools.product, self.params['roads'].values())]
-        return [dict(zip(self.params['roads'].keys(), p)) for p in product]
+        ''' This method generates all possible route throughput rate combinations one by one'''
+        for p in apply(itertools.product, self.params['roads'].values()):
+            yield dict(zip(self.params['roads'].keys(), p))
     
     
     def generateGeneralParamSets(self):
-        ''' This method generates all possible general simulation parameter combinations'''
+        ''' This method generates all possible general simulation parameter combinations one by one'''
         values = [value if hasattr(value, '__iter__') else [value] for value in self.params['general'].values()]
-        product = [x for x in apply(itertools.product, values)]
-        return [dict(zip(self.params['general'].keys(), p)) for p in product]
+        for p in apply(itertools.product, values):
+            yield dict(zip(self.params['general'].keys(), p))
+
+
+    def generateParamCombinations(self):
+        ''' This method generates all (general, road, route) parameter combinations one by one,
+        without keeping any of the parameter sets in memory'''
+        for generalParamSet in self.generateGeneralParamSets():
+            for roadSet in self.generateRoadSets():
+                for routeSet in self.generateRouteSets():
+                    yield (generalParamSet, roadSet, routeSet)
+
+
+    def getParameterDimensions(self):
+        ''' This method gets every parameter that has more than one experimentation value, as a
+        list of (kind, key, values) triples. The key of a route parameter is (routeID, name)'''
+        dimensions = []
+        for key in sorted(self.params['general']):
+            values = self.params['general'][key]
+            if hasattr(values, '__iter__') and len(values) > 1:
+                dimensions.append(('general', key, values))
+        for key in sorted(self.params['roads']):
+            if len(self.params['roads'][key]) > 1:
+                dimensions.append(('roads', key, self.params['roads'][key]))
+        for routeID in sorted(self.params['routes']):
+            for key in sorted(self.params['routes'][routeID]):
+                if len(self.params['routes'][routeID][key]) > 1:
+                    dimensions.append(('routes', (routeID, key), self.params['routes'][routeID][key]))
+        return dimensions
+
+
+    def getParamCombination(self, dimensions, point):
+        ''' This method gets the (general, road, route) parameter combination where every
+        dimension takes the value with the index given in the point'''
+        generalParamSet = dict([(key, value[0] if hasattr(value, '__iter__') else value)
+                                for (key, value) in self.params['general'].items()])
+        roadSet = dict([(key, value[0]) for (key, value) in self.params['roads'].items()])
+        routes = dict([(routeID, dict([(key, value[0]) for (key, value) in route.items()]))
+                       for (routeID, route) in self.params['routes'].items()])
+        for ((kind, key, values), index) in zip(dimensions, point):
+            if kind == 'general':
+                generalParamSet[key] = values[index]
+            elif kind == 'roads':
+                roadSet[key] = values[index]
+            else:
+                routes[key[0]][key[1]] = values[index]
+        return (generalParamSet, roadSet, [routes[routeID] for routeID in self.params['routes']])
+
+
+    def countParamCombinations(self):
+        ''' This method counts the parameter combinations without generating them'''
+        count = 1
+        for value in self.params['general'].values():
+            count *= len(value) if hasattr(value, '__iter__') else 1
+        for value in self.params['roads'].values():
+            count *= len(value)
+        for route in self.params['routes'].values():
+            for value in route.values():
+                count *= len(value)
+        return count
     
         
-    def printExperimentationParameters(self, generalParamSet, roadSet, routeSet): 
-        ''' Method that prints all experimentation values of the given parameter dicts''' 
+    def getExperimentationParameters(self, generalParamSet, roadSet, routeSet):
+        ''' Method that gets the output lines for all experimentation values of the given parameter dicts'''
+        lines = []
         for key in generalParamSet:
             if len(self.params['general'][key]) > 1:
-                print key + ' ' + str(generalParamSet[key])
+                lines.append(key + ' ' + str(generalParamSet[key]))
         for (stop1, stop2) in roadSet:
             if len(self.params['roads'][(stop1, stop2)]) > 1:
-                print 'road {0} {1} {2}'.format(stop1, stop2, roadSet[(stop1, stop2)])
+                lines.append('road {0} {1} {2}'.format(stop1, stop2, roadSet[(stop1, stop2)]))
         for route in routeSet:
             outStr = ''
             for key in self.params['routes'].values()[0]:
                 if len(self.params['routes'][route['routeID']][key]) > 1:
                     outStr += ' ' + key + ' ' + str(route[key])
             if outStr != '':
-                print 'route ' + str(route['routeID']) + outStr
+                lines.append('route ' + str(route['routeID']) + outStr)
+        return lines
+
+
+    def printExperimentationParameters(self, generalParamSet, roadSet, routeSet): 
+        ''' Method that prints all experimentation values of the given parameter dicts''' 
+        for line in self.getExperimentationParameters(generalParamSet, roadSet, routeSet):
+            print line
         
 
-    def executeExperimentation(self, generalParamSets, roadSets, routeSets):
-        ''' This method performs experimentation over all parameter values'''
-        initialNetwork = deepcopy(self.Network)
-        for generalParamSet in generalParamSets:
-            for roadSet in roadSets:
-                for routeSet in routeSets:
-                    self.Network.changeGeneralParams(generalParamSet)
-                    self.Network.changeRoadParams(roadSet)
-                    self.Network.changeRouteParams(routeSet)
-                    self.printExperimentationParameters(generalParamSet, roadSet, routeSet)
-                    self.executeSimulationLoop(outputEvents=False)
-                    self.printStatistics()
-                    self.Network = deepcopy(initialNetwork)
+    def applyCombination(self, initialNetwork, generalParamSet, roadSet, routeSet):
+        ''' This method brings the network to the initial network snapshot and sets the
+        parameters of the given combination'''
+        self.Network.restore(initialNetwork)
+        self.Network.changeGeneralParams(generalParamSet)
+        self.Network.changeRoadParams(roadSet)
+        self.Network.changeRouteParams(routeSet)
+
+
+    def runCombination(self, initialNetwork, generalParamSet, roadSet, routeSet, stopCondition=None, replication=0):
+        ''' This method runs the simulation from the initial network snapshot with the given
+        parameter combination. It returns False if the run was stopped by the stop condition'''
+        self.applyCombination(initialNetwork, generalParamSet, roadSet, routeSet)
+        return self.executeSimulationLoop(False, stopCondition, replication)
+
+
+    def simulateReplications(self, count, first=0):
+        ''' This method runs the given number of independent replications of the simulation,
+        starting from the current state of the network, and returns the list of their statistics.
+        The replications are numbered from first, which offsets their seeds. The vectorised
+        engine runs all of them at once; otherwise they are run one by one.
+        Afterwards the network is brought back to the state it was in'''
+        statistics = []
+        initialNetwork = self.Network.snapshot()
+        if self.params['control'].get('engine') == 'vectorised':
+            seed = self.params['control'].get('seed')
+            stream = RandomStreams.RandomStream(None if seed is None else seed + first)
+            engine = Engines.VectorisedEngine(self.Network, self.params['control']['stopTime'], count, stream.getNumpyRandom())
+            engine.run()
+            for replication in range(count):
+                engine.storeStatistics(replication)
+                statistics.append(self.getStatistics())
+        else:
+            for replication in range(first, first + count):
+                self.Network.restore(initialNetwork)
+                self.executeSimulationLoop(False, replication=replication)
+                statistics.append(self.getStatistics())
+        self.Network.restore(initialNetwork)
+        return statistics
+
+
+    def simulateCombination(self, initialNetwork, generalParamSet, roadSet, routeSet, replication=0):
+        ''' This method runs the simulation with the given parameter combination and
+        returns the statistics of the run. If the run is in the cache, it isn't simulated'''
+        combination = (generalParamSet, roadSet, routeSet)
+        (key, statistics) = self.getCachedStatistics(initialNetwork, combination, replication)
+        if statistics is None:
+            self.runCombination(initialNetwork, generalParamSet, roadSet, routeSet, replication=replication)
+            statistics = self.getStatistics()
+            if key is not None:
+                self.cache.put(key, statistics)
+        return statistics
+
+
+    def getCachedStatistics(self, initialNetwork, combination, replication=0):
+        ''' This method looks up the run of the given combination in the result cache. It
+        returns the cache key of the run and its statistics, or None for the statistics if the
+        run isn't in the cache. Without a cache file or a seed the runs differ every time, so
+        the key is None as well'''
+        seed = self.params['control'].get('seed')
+        if (not 'cacheFile' in self.params['control']) or (seed is None):
+            return (None, None)
+        if self.cache is None:
+            self.cache = Cache.ResultCache(self.params['control']['cacheFile'])
+        control = self.params['control']
+        key = Cache.getKey(initialNetwork, combination, control['stopTime'], seed + replication, control.get('engine'),
+                           control.get('tau'), control['commonRandomNumbers'], self.startStateKey,
+                           # The same seed gives different numbers with and without NumPy:
+                           RandomStreams.numpy is not None)
+        return (key, self.cache.get(key))
+
+
+    def storeStatistics(self, key):
+        ''' This method stores the statistics of the most recent run in the result cache'''
+        self.cache.put(key, self.getStatistics())
+
+
+    def replicateCombination(self, initialNetwork, combination, pool=None):
+        ''' This method runs replications of the given parameter combination and returns the list
+        of their statistics. If a precision is specified, more replications are run until the
+        confidence intervals of the network statistics are narrow enough. The replications are
+        run in the given pool of processes, if there is one'''
+        checkpointKey = self.getCheckpointKey('replications', combination)
+        if self.isCheckpointed(checkpointKey):
+            return self.checkpoint.get(checkpointKey)
+        statistics = self.runReplications(initialNetwork, combination, pool)
+        self.addToCheckpoint(checkpointKey, statistics)
+        return statistics
+
+
+    def runReplications(self, initialNetwork, combination, pool=None):
+        ''' This method runs the replications of the given parameter combination for
+        the replicateCombination method'''
+        count = self.params['control']['replications']
+        statistics = []
+        while True:
+            first = len(statistics)
+            if pool is not None:
+                tasks = [(combination, replication) for replication in range(first, first + count)]
+                statistics.extend(pool.map(simulateReplication, tasks))
+            elif self.params['control'].get('engine') == 'vectorised':
+                self.applyCombination(initialNetwork, *combination)
+                statistics.extend(self.simulateReplications(count, first))
+            else:
+                # The replications are run one by one, so each of them can be taken from the cache:
+                for replication in range(first, first + count):
+                    statistics.append(self.simulateCombination(initialNetwork, *combination, replication=replication))
+            if not 'precision' in self.params['control']:
+                return statistics
+            if len(statistics) >= MAX_REPLICATIONS:
+                warnings.warn('The confidence intervals are still too wide after {0} replications'.format(len(statistics)))
+                return statistics
+            if self.isPrecise(self.getSummary(statistics), self.params['control']['precision']):
+                return statistics
+
+
+    def getSummary(self, statistics):
+        ''' Method that gets the mean and the half-width of the 95% confidence interval of every
+        statistic over the given replications, as a list of (name, mean, half-width) triples'''
+        count = len(statistics)
+        if count > 1:
+            t = getTValue(count - 1)
+        summary = []
+        for (i, (name, value)) in enumerate(statistics[0]):
+            values = [replication[i][1] for replication in statistics]
+            mean = sum(values) / float(count)
+            if count > 1:
+                variance = sum([(value - mean)**2 for value in values]) / (count - 1.0)
+                halfWidth = t * (variance / count)**0.5
+            else:
+                halfWidth = float('inf')
+            summary.append((name, mean, halfWidth))
+        return summary
+
+
+    def isPrecise(self, summary, precision):
+        ''' Method that checks if the confidence intervals of the network statistics are no wider
+        than the given fraction of their means. A statistic with a mean of 0 or close to it can't
+        get that precise, so a confidence interval no wider than MIN_HALF_WIDTH is always enough'''
+        for (name, mean, halfWidth) in summary:
+            if (name in NETWORK_STATISTICS) and (halfWidth > max(precision * abs(mean), MIN_HALF_WIDTH)):
+                return False
+        return True
+
+
+    def printSummary(self, summary, count):
+        ''' Method that prints the means and the 95% confidence intervals of the statistics'''
+        print 'replications {0}'.format(count)
+        for (name, mean, halfWidth) in summary:
+            print '{0} {1} +- {2}'.format(name, mean, halfWidth)
+        print ''
+
+
+    def executeExperimentation(self, combinations):
+        ''' This method performs experimentation over all parameter values. If more than one
+        worker is specified, the combinations are simulated in a pool of processes, but the
+        output is still printed in the same order'''
+        initialNetwork = self.Network.snapshot()
+        workers = self.params['control'].get('workers', 1)
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initialiseWorker, (self.params, initialNetwork))
+        if 'replications' in self.params['control']:
+            # The replications of every combination are run in parallel instead of the combinations:
+            for combination in combinations:
+                statistics = self.replicateCombination(initialNetwork, combination, self.getReplicationPool(pool))
+                self.printExperimentationParameters(*combination)
+                self.printSummary(self.getSummary(statistics), len(statistics))
+        else:
+            results = self.simulateCombinations(initialNetwork, combinations, pool)
+            for ((generalParamSet, roadSet, routeSet), statistics) in results:
+                self.printExperimentationParameters(generalParamSet, roadSet, routeSet)
+                self.printStatistics(statistics)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        self.Network.restore(initialNetwork)
                             
                                           
-    def executeOptimisation(self, generalParamSets, roadSets, routeSets):
+    def simulateCombinations(self, initialNetwork, combinations, pool=None):
+        ''' This method simulates the given parameter combinations, in the given pool of
+        processes if there is one, and generates (combination, statistics) pairs in the
+        original order. The combinations in the checkpoint aren't simulated again'''
+        # The pool takes its tasks all at once, so it is only given a batch at a time:
+        for batch in batches(combinations, 1 if pool is None else self.params['control'].get('workers', 1) * 16):
+            keys = [self.getCheckpointKey('statistics', combination) for combination in batch]
+            unfinished = [combination for (combination, key) in zip(batch, keys) if not self.isCheckpointed(key)]
+            if pool is not None:
+                results = pool.imap(simulateCombination, unfinished)
+            else:
+                results = ((combination, self.simulateCombination(initialNetwork, *combination)) for combination in unfinished)
+            for (combination, key) in zip(batch, keys):
+                if self.isCheckpointed(key):
+                    statistics = self.checkpoint.get(key)
+                else:
+                    statistics = next(results)[1]
+                    self.addToCheckpoint(key, statistics)
+                yield (combination, statistics)
+
+
+    def getReplicationPool(self, pool):
+        ''' Method that gets the pool the replications should be run in. The vectorised
+        engine runs them all at once in this process, so it doesn't use the pool'''
+        if self.params['control'].get('engine') == 'vectorised':
+            return None
+        return pool
+
+
+    def getParameterSum(self, generalParamSet, roadSet, routeSet):
+        ''' This method gets the sum of all values of a parameter combination. The cost of
+        the combination is the number of missed passengers multiplied by this sum'''
+        generalParamSum = sum(generalParamSet.values())
+        roadParamSum = sum(roadSet.values())
+        routeParamSum = sum(sum([route.values() for route in routeSet], []))
+        return generalParamSum + roadParamSum + routeParamSum
+
+
+    def getMissedPassengers(self):
+        ''' This method gets the total number of passengers missed in the network so far'''
+        return sum([stop.missedPassengers for stop in self.Network.stops.values()])
+
+
+    def getCombinationCost(self, initialNetwork, combination, stopTime=None):
+        ''' This method gets the cost of the given parameter combination. If the stop time is
+        given, the simulation is run until then instead of the stop time of the input'''
+        fullStopTime = self.params['control']['stopTime']
+        if stopTime is not None:
+            self.params['control']['stopTime'] = stopTime
+        try:
+            checkpointKey = self.getCheckpointKey('cost', combination)
+            if self.isCheckpointed(checkpointKey):
+                return self.checkpoint.get(checkpointKey)
+            (key, statistics) = self.getCachedStatistics(initialNetwork, combination)
+            if statistics is not None:
+                cost = dict(statistics)['number of missed passengers'] * self.getParameterSum(*combination)
+            else:
+                self.runCombination(initialNetwork, *combination)
+                if key is not None:
+                    self.storeStatistics(key)
+                cost = self.getMissedPassengers() * self.getParameterSum(*combination)
+            self.addToCheckpoint(checkpointKey, cost)
+        finally:
+            self.params['control']['stopTime'] = fullStopTime
+        return cost
+
+
+    def getCombinationCosts(self, initialNetwork, combinations, stopTime=None, pool=None):
+        ''' This method gets the costs of the given parameter combinations, in the given pool
+        of processes if there is one'''
+        if pool is None:
+            return [self.getCombinationCost(initialNetwork, combination, stopTime) for combination in combinations]
+        keys = [self.getCheckpointKey('cost', combination, stopTime) for combination in combinations]
+        unfinished = [i for i in range(len(combinations)) if not self.isCheckpointed(keys[i])]
+        costs = dict(zip(unfinished, pool.map(getCombinationCost, [(combinations[i], stopTime) for i in unfinished])))
+        for i in unfinished:
+            self.addToCheckpoint(keys[i], costs[i])
+        return [costs[i] if i in costs else self.checkpoint.get(keys[i]) for i in range(len(combinations))]
+
+
+    def getCheckpointKey(self, kind, combination, stopTime=None):
+        ''' This method gets the key that the given kind of result of the combination is stored
+        under in the checkpoint, or None if there is no checkpoint'''
+        if self.checkpoint is None:
+            return None
+        if stopTime is None:
+            stopTime = self.params['control']['stopTime']
+        return Cache.getKey(kind, combination, stopTime)
+
+
+    def isCheckpointed(self, key):
+        ''' This method checks if the result with the given key is in the checkpoint'''
+        return (self.checkpoint is not None) and (key in self.checkpoint)
+
+
+    def addToCheckpoint(self, key, result):
+        ''' This method stores a result in the checkpoint, if there is one'''
+        if self.checkpoint is not None:
+            self.checkpoint.add(key, result)
+
+
+    def executeOptimisation(self, combinations):
         ''' This method performs parameter optimisation'''
-        minCost = None
-        initialNetwork = deepcopy(self.Network)
-        for generalParamSet in generalParamSets:
-            for roadSet in roadSets:
-                for routeSet in routeSets:
-                    if minCost != 0:
-                        self.Network.changeGeneralParams(generalParamSet)
-                        self.Network.changeRoadParams(roadSet)
-                        self.Network.changeRouteParams(routeSet)
-                        self.executeSimulationLoop(outputEvents=False)
-                        # Getting the number of missed passengers:
-                        totalPassengers = sum([stop.missedPassengers for stop in self.Network.stops.values()])
-                        generalParamSum = sum(generalParamSet.values())
-                        roadParamSum = sum(roadSet.values())
-                        routeParamSum = sum(sum([route.values() for route in routeSet], []))
-                        cost = totalPassengers * (generalParamSum + roadParamSum + routeParamSum)
-                        if not (minCost) or (minCost > cost):
-                            minCost = cost
-                            maxGeneralParamSet = generalParamSet
-                            maxRoadSet = roadSet
-                            maxRouteSet = routeSet
-                        self.Network = deepcopy(initialNetwork)
+        initialNetwork = self.Network.snapshot()
+        workers = self.params['control'].get('workers', 1)
+        evaluations = None
+        if 'optimiser' in self.params['control']:
+            pool = None
+            if workers > 1:
+                pool = multiprocessing.Pool(workers, initialiseWorker, (self.params, initialNetwork))
+            arguments = (self, initialNetwork, pool)
+            if 'budget' in self.params['control']:
+                arguments += (self.params['control']['budget'],)
+            optimiser = Optimisers.OPTIMISERS[self.params['control']['optimiser']](*arguments)
+            bestCombination = optimiser.optimise(combinations)
+            evaluations = optimiser.evaluations
+            if pool is not None:
+                pool.close()
+                pool.join()
+        elif workers > 1:
+            bestCombination = self.executeParallelOptimisation(initialNetwork, combinations, workers)
+        else:
+            minCost = None
+            for combination in combinations:
+                if minCost != 0:
+                    cost = self.getCombinationCost(initialNetwork, combination)
+                    if not (minCost) or (minCost > cost):
+                        minCost = cost
+                        bestCombination = combination
+        self.Network.restore(initialNetwork)
         print 'Bus network is optimized with setting the parameters as:'
-        self.printExperimentationParameters(maxGeneralParamSet, maxRoadSet, maxRouteSet)
+        self.printExperimentationParameters(*bestCombination)
+        if evaluations is not None:
+            print 'evaluations {0}'.format(evaluations)
+
+
+    def executeParallelOptimisation(self, initialNetwork, combinations, workers):
+        ''' This method evaluates the combinations in a pool of processes and returns the one
+        with the lowest cost. The workers share the best cost found so far and abandon the
+        runs that already missed too many passengers to beat it. Ties go to the combination
+        that comes first, so the result is the same as the one of the serial optimisation'''
+        bestCost = multiprocessing.Value('d', float('inf'))
+        # A C int would wrap around on grids of over 2^31 combinations, so the index is a double:
+        bestIndex = multiprocessing.Value('d', float('inf'))
+        pool = multiprocessing.Pool(workers, initialiseWorker, (self.params, initialNetwork, (bestCost, bestIndex)))
+        best = None
+        for batch in batches(enumerate(combinations), workers * 16):
+            keys = dict([(index, self.getCheckpointKey('cost', combination)) for (index, combination) in batch])
+            results = [(index, self.checkpoint.get(keys[index])) for (index, combination) in batch if self.isCheckpointed(keys[index])]
+            for (index, cost) in results:
+                # The workers can abandon more runs if they know the best cost of the finished ones:
+                with bestCost.get_lock():
+                    if (cost, index) < (bestCost.value, bestIndex.value):
+                        bestCost.value = cost
+                        bestIndex.value = index
+            unfinished = [(index, combination) for (index, combination) in batch if not self.isCheckpointed(keys[index])]
+            for (index, cost) in itertools.chain(results, pool.imap_unordered(evaluateCombination, unfinished)):
+                if cost is not None:
+                    self.addToCheckpoint(keys[index], cost)
+                if cost is not None and (best is None or (cost, index) < best[:2]):
+                    best = (cost, index, dict(batch)[index])
+        pool.close()
+        pool.join()
+        if best is None:
+            # No run gave a cost, so as in the serial optimisation the first combination is kept:
+            return next(self.generateParamCombinations())
+        return best[2]
     
     
-    def printStatistics(self):
-        ''' Method that prints the statistics of the most recent run of the simulation'''
+    def getStatistics(self):
+        ''' Method that gets the statistics of the most recent run of the simulation
+        as a list of (name, value) pairs in the order they are printed. An average over
+        nothing (e.g. the queueing at a stop that no bus came to) is NaN'''
+        statistics = []
         # Missed passengers:
         total = 0
         for stop in self.Network.stops.values():
-            print 'number of missed passengers stop {0} {1}'.format(stop.stopID, stop.missedPassengers)
+            statistics.append(('number of missed passengers stop {0}'.format(stop.stopID), stop.missedPassengers))
             total += stop.missedPassengers
         for route in self.Network.routes.values():
-            print 'number of missed passengers route {0} {1}'.format(route.routeID, route.missedPassengers)
-        print 'number of missed passengers {0}'.format(total)
+            statistics.append(('number of missed passengers route {0}'.format(route.routeID), route.missedPassengers))
+        statistics.append(('number of missed passengers', total))
         # Average number of passengers:
         total = 0.0
         for route in self.Network.routes.values():
             totalPerRoute = 0.0
             for bus in route.buses:
-                print 'average passengers bus {0}.{1} {2}'.format(bus.routeID, bus.busNumber, bus.averagePassengersTravelling)
+                statistics.append(('average passengers bus {0}.{1}'.format(bus.routeID, bus.busNumber), bus.averagePassengersTravelling))
                 totalPerRoute += bus.averagePassengersTravelling
             ''' I find this statistic a bit ambiguous. There are 2 possible cases:
                 1. The "average passengers route" should say how many passengers on average are on one of the route's buses
                 2. The "average passengers route" should say how many passengers on average are on the entire route
                 I left the first case uncommented. The second one is commented out below the first one.
             '''
-            print 'average passengers route {0} {1}'.format(route.routeID, totalPerRoute/len(route.buses))
-            #print 'average passengers route {0} {1}'.format(route.routeID, totalPerRoute)
+            statistics.append(('average passengers route {0}'.format(route.routeID), average(totalPerRoute, len(route.buses))))
+            #statistics.append(('average passengers route {0}'.format(route.routeID), totalPerRoute))
             total += totalPerRoute
         ''' I find this statistic a bit ambiguous. There are 2 possible cases:
             1. The "average passengers" should say how many passengers on average are on one of the routes
             2. The "average passengers" should say how many passengers on average are on the entire network
             I left the first case uncommented. The second one is commented out below the first one.
         '''
-        print 'average passengers {0}'.format(total/len(self.Network.routes))
-        #print 'average passengers {0}'.format(total)
+        statistics.append(('average passengers', average(total, len(self.Network.routes))))
+        #statistics.append(('average passengers', total))
         # Average time spent queueing:
         totalTime = 0.0
         totalBuses = 0
         for stop in self.Network.stops.values():
-            print 'average queueing at stop {0} {1}'.format(stop.stopID, stop.totalQueueingTime/stop.numberOfBusesQueued)
+            statistics.append(('average queueing at stop {0}'.format(stop.stopID), average(stop.totalQueueingTime, stop.numberOfBusesQueued)))
             totalTime += stop.totalQueueingTime
             totalBuses += stop.numberOfBusesQueued
-        print 'average queueing at all stops {0}'.format(totalTime/totalBuses)
+        statistics.append(('average queueing at all stops', average(totalTime, totalBuses)))
+        return statistics
+
+
+    def printStatistics(self, statistics=None):
+        ''' Method that prints the given statistics or, if none are given, the statistics
+        of the most recent run of the simulation'''
+        if statistics is None:
+            statistics = self.getStatistics()
+        for (name, value) in statistics:
+            print '{0} {1}'.format(name, value)
         # I am not sure if there should be an empty line printed after the statistics.
         # It looks nicer, but if it messes up your output parser then just comment it out.
         print ''
@@ -183,54 +603,234 @@ class Simulation:
 
     def executeSimulation(self):
         ''' This method chooses the right kind of simulation type to be run '''
-        generalParamSets = self.generateGeneralParamSets()
-        roadSets = self.generateRoadSets()
-        routeSets = self.generateRouteSets()
+        if self.params['control']['groupPassengers']:
+            self.Network.setPassengerStorage(Models.PassengerGroups)
+        if 'loadStateFile' in self.params['control']:
+            self.readState()
+            self.Network.setState(self.startState['network'])
+        if ('checkpointFile' in self.params['control']) and (self.params['control']['optimiseParameters'] or
+                self.params['control']['experimentation'] or ('replications' in self.params['control'])):
+            self.startCheckpoint()
+        if ((self.params['control']['commonRandomNumbers'] or ('optimiser' in self.params['control']))
+                and not ('seed' in self.params['control'])):
+            # All of the runs have to share a seed, even if it isn't given:
+            self.params['control']['seed'] = random.getrandbits(32)
+        if self.checkpoint is not None:
+            self.checkpoint.seed = self.params['control'].get('seed')
         if self.params['control']['optimiseParameters']:
-            self.executeOptimisation(generalParamSets, roadSets, routeSets)
+            self.executeCheckpointed(self.executeOptimisation, self.generateParamCombinations())
         elif self.params['control']['experimentation']:
-            self.executeExperimentation(generalParamSets, roadSets, routeSets)
+            self.executeCheckpointed(self.executeExperimentation, self.generateParamCombinations())
+        elif 'replications' in self.params['control']:
+            self.executeCheckpointed(self.executeReplications, next(self.generateParamCombinations()))
         else:
-            self.Network.changeGeneralParams(generalParamSets[0])
-            self.Network.changeRoadParams(roadSets[0])
-            self.Network.changeRouteParams(routeSets[0])
+            if self.startState is None:
+                # A saved run carries on with its own parameters:
+                (generalParamSet, roadSet, routeSet) = next(self.generateParamCombinations())
+                self.Network.changeGeneralParams(generalParamSet)
+                self.Network.changeRoadParams(roadSet)
+                self.Network.changeRouteParams(routeSet)
+            if 'traceFile' in self.params['control']:
+                occupancy = dict([(stop.stopID, len(stop.passengers)) for stop in self.Network.stops.values()])
+                self.Network.eventSink = Trace.BinarySink(open(self.params['control']['traceFile'], 'wb'),
+                                                          startTime=self.getStartTime(), occupancy=occupancy)
+            elif 'eventFile' in self.params['control']:
+                self.Network.eventSink = Events.TextSink(open(self.params['control']['eventFile'], 'w'))
             self.executeSimulationLoop()
-            self.printStatistics()
+            self.Network.eventSink.close()
+            if not ('saveStateFile' in self.params['control']):
+                self.printStatistics()
             
 
-    def executeSimulationLoop(self, outputEvents=True):
-        ''' This method implements the main simulation loop '''
-        currentTime = 0
+    def startCheckpoint(self):
+        ''' This method loads the checkpoint of the job, or starts a new one. The job is
+        identified by the network and the parameters of the input, apart from the number of
+        workers, which may change when the job is restarted. If the seed isn't given,
+        the restarted job uses the seed it was started with'''
+        control = dict(self.params['control'])
+        control.pop('workers', None)
+        job = Cache.getKey(self.Network.snapshot(), dict(self.params, control=control), self.startStateKey)
+        self.checkpoint = Checkpoints.Checkpoint(self.params['control']['checkpointFile'], job)
+        if (self.checkpoint.seed is not None) and not ('seed' in self.params['control']):
+            self.params['control']['seed'] = self.checkpoint.seed
+
+
+    def executeCheckpointed(self, method, argument):
+        ''' This method runs the given job with the checkpoint, if there is one. The checkpoint
+        is written if the job is interrupted and removed when the job is finished. A job that
+        is stopped with SIGTERM (as on preemptible nodes) is interrupted by SystemExit'''
+        if self.checkpoint is None:
+            return method(argument)
+        previousHandler = signal.signal(signal.SIGTERM, terminate)
+        try:
+            method(argument)
+        except BaseException:
+            self.checkpoint.write()
+            raise
+        finally:
+            signal.signal(signal.SIGTERM, previousHandler)
+        self.checkpoint.finish()
+
+
+    def executeReplications(self, combination):
+        ''' This method runs replications of a single parameter combination and prints the means
+        and confidence intervals of the statistics. If more than one worker is specified, the
+        replications are run in a pool of processes'''
+        initialNetwork = self.Network.snapshot()
+        workers = self.params['control'].get('workers', 1)
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initialiseWorker, (self.params, initialNetwork))
+        statistics = self.replicateCombination(initialNetwork, combination, self.getReplicationPool(pool))
+        if pool is not None:
+            pool.close()
+            pool.join()
+        self.Network.restore(initialNetwork)
+        self.printSummary(self.getSummary(statistics), len(statistics))
+
+
+    def executeSimulationLoop(self, outputEvents=True, stopCondition=None, replication=0):
+        ''' This method implements the main simulation loop. If a stop condition is given,
+        it is checked every few hundred events and the loop returns False as soon as it holds.
+        If another engine is chosen, it runs the simulation instead of this loop.
+        Every run starts with a new random stream. If the seed is specified, the stream
+        is seeded with it, offset by the number of the replication. With common random
+        numbers every kind of event gets its own stream.
+        If a saved state is loaded, the runs start at its time, and the first replication
+        carries on with its random streams. If the state is to be saved, the loop stops
+        at the first event after the given time and writes the state to the file'''
+        seed = self.params['control'].get('seed')
+        if seed is not None:
+            seed += replication
+        resume = (self.startState is not None) and (replication == 0)
+        if resume:
+            self.Network.setRandomState(self.startState['network'])
+        elif self.params['control']['commonRandomNumbers']:
+            self.Network.setCommonRandomStreams(seed, RANDOM_BLOCK_SIZE)
+        else:
+            self.Network.setRandomStream(RandomStreams.RandomStream(seed, RANDOM_BLOCK_SIZE))
+            self.Network.clearArrivals()
+        self.Network.arrivalBlockSize = ARRIVAL_BLOCK_SIZE
+        if self.params['control'].get('engine') == 'next reaction':
+            engine = Engines.NextReactionEngine(self.Network, self.params['control']['stopTime'], outputEvents, stopCondition)
+            return engine.run()
+        if self.params['control'].get('engine') == 'tau leaping':
+            engine = Engines.TauLeapingEngine(self.Network, self.params['control']['stopTime'], self.params['control']['tau'], outputEvents, stopCondition)
+            return engine.run()
+        if self.params['control']['commonRandomNumbers']:
+            return self.executeCommonRandomLoop(outputEvents, stopCondition, resume)
+        currentTime = self.getStartTime()
+        pauseTime = self.params['control'].get('saveStateTime', float('inf'))
+        events = 0
         while currentTime <= self.params['control']['stopTime']:
+            if currentTime > pauseTime:
+                self.Network.eventSink.flush()
+                self.writeState(currentTime)
+                return True
+            if stopCondition is not None:
+                events += 1
+                if (events % 256 == 0) and stopCondition():
+                    self.Network.eventSink.flush()
+                    return False
             # Getting all of the events that could occur:
             rates = self.getEventRates()
             totalRate = (self.Network.params['new passengers'] + rates['paxRTBRate'] +
                          rates['paxRTDRate'] + rates['busesRTARate'] +
                          rates['busesRTDRate'])
-            delay = -(1.0/totalRate) * log10(uniform(0.0, 1.0))
+            delay = self.Network.rng.exponential() / totalRate
             self.executeNextEvent(totalRate, rates, currentTime, outputEvents)
             currentTime += delay
+        self.Network.eventSink.flush()
         self.Network.finishTakingStatistics(self.params['control']['stopTime'])
+        return True
+
+
+    def executeCommonRandomLoop(self, outputEvents, stopCondition, resume=False):
+        ''' This method implements the simulation loop used with common random numbers. The new
+        passengers arrive at times drawn from their own stream, so the runs with the same seed
+        get the same passengers at the same times. The rest of the events are picked as in the
+        main loop; as the delays are exponential, the simulated process stays the same.
+        If the run carries on from a saved state, so does the time of the next new passenger'''
+        network = self.Network
+        stopTime = self.params['control']['stopTime']
+        pauseTime = self.params['control'].get('saveStateTime', float('inf'))
+        newRate = network.params['new passengers']
+        currentTime = self.getStartTime()
+        if resume:
+            nextArrival = self.startState['nextArrival']
+        else:
+            nextArrival = currentTime + (network.arrivalRng.exponential() / newRate if newRate > 0 else float('inf'))
+        events = 0
+        while True:
+            if currentTime > pauseTime:
+                network.eventSink.flush()
+                self.writeState(currentTime, nextArrival)
+                return True
+            if stopCondition is not None:
+                events += 1
+                if (events % 256 == 0) and stopCondition():
+                    network.eventSink.flush()
+                    return False
+            rates = self.getEventRates()
+            totalRate = rates['paxRTBRate'] + rates['paxRTDRate'] + rates['busesRTARate'] + rates['busesRTDRate']
+            delay = network.rng.exponential() / totalRate if totalRate > 0 else float('inf')
+            if nextArrival <= currentTime + delay:
+                currentTime = nextArrival
+                if currentTime > stopTime:
+                    break
+                network.addPassenger(currentTime, outputEvents)
+                nextArrival += network.arrivalRng.exponential() / newRate
+            else:
+                currentTime += delay
+                if currentTime > stopTime:
+                    break
+                self.executeNextEvent(totalRate, rates, currentTime, outputEvents)
+        network.eventSink.flush()
+        network.finishTakingStatistics(stopTime)
+        return True
+
+
+    def getStartTime(self):
+        ''' This method gets the time that the runs start at'''
+        return 0.0 if self.startState is None else self.startState['time']
+
+
+    def writeState(self, currentTime, nextArrival=None):
+        ''' This method writes the state of the paused run to the file given in the input'''
+        stateFile = gzip.open(self.params['control']['saveStateFile'], 'wb')
+        cPickle.dump({'network' : self.Network.getState(), 'time' : currentTime, 'nextArrival' : nextArrival}, stateFile, 2)
+        stateFile.close()
+
+
+    def readState(self):
+        ''' This method reads the saved state that the runs start from'''
+        stateFile = open(self.params['control']['loadStateFile'], 'rb')
+        data = stateFile.read()
+        stateFile.close()
+        self.startState = cPickle.loads(gzip.GzipFile(fileobj=StringIO.StringIO(data)).read())
+        self.startStateKey = hashlib.sha1(data).hexdigest()
+        if self.startState['time'] > self.params['control']['stopTime']:
+            raise Exception('The saved state is past the stop time')
 
 
     def getEventRates(self):
         ''' This method gets rates needed for choosing the event to execute'''
         rates = {}
         # Passengers ready to board rate:
-        rates['paxRTBRate'] = len(self.Network.getPaxRTB()) * self.Network.params['board']
+        rates['paxRTBRate'] = self.Network.totalPaxRTB * self.Network.params['board']
         # Passengers ready to disembark rate:
-        rates['paxRTDRate'] = len(self.Network.getPaxRTD()) * self.Network.params['disembarks']
+        rates['paxRTDRate'] = self.Network.totalPaxRTD * self.Network.params['disembarks']
         # Buses ready to depart rate:
-        rates['busesRTDRate'] = len(self.Network.getBusesRTD()) * self.Network.params['departs']
+        rates['busesRTDRate'] = self.Network.totalBusesRTD * self.Network.params['departs']
         # Buses ready to arrive rate:
-        rates['busesRTARate'] = sum([self.Network.getThroughput(bus) for (bus, route) in self.Network.getBusesRTA()])
+        rates['busesRTARate'] = self.Network.busesRTA.total()
         #print rates
         return rates
 
 
     def executeNextEvent(self, totalRate, rates, time, outputEvents):
         ''' This method chooses and executes an event, based on event rates'''
-        choice = uniform(0, totalRate)
+        choice = self.Network.rng.random() * totalRate
         if choice < rates['paxRTBRate']:
             self.Network.boardPassenger(time, outputEvents)
         elif choice < (rates['paxRTBRate'] + rates['paxRTDRate']):
@@ -279,12 +879,121 @@ class Simulation:
                         roadUsed = True
             if not roadUsed:
                 warnings.warn('Road between stops {0} and {1} is specified but not used'.format(depStop, destStop))
+        # Checking if the vectorised engine has replications to run, as nothing else uses it:
+        if (self.params['control'].get('engine') == 'vectorised') and not ('replications' in self.params['control']):
+            raise Exception('The vectorised engine can only be used with replications')
+        if (self.params['control'].get('engine') == 'vectorised') and (Engines.numpy is None):
+            raise Exception('The vectorised engine needs NumPy to be installed')
+        # Checking if the state can be saved or loaded:
+        if ('saveStateFile' in self.params['control']) or ('loadStateFile' in self.params['control']):
+            if 'engine' in self.params['control']:
+                raise Exception('The state can only be saved and loaded with the default simulation loop')
+        if 'saveStateFile' in self.params['control']:
+            if (self.params['control']['experimentation'] or ('replications' in self.params['control'])):
+                raise Exception('The state can only be saved by a single simulation run')
+            if self.params['control']['saveStateTime'] >= self.params['control'].get('stopTime', 0):
+                raise Exception('The state has to be saved before the stop time')
         # Checking if the simulation has experimentation parameters if we need to optimise it:
         if self.params['control']['optimiseParameters'] and not (self.params['control']['experimentation']):
             raise Exception('There are no experimentation values given although optimisation flag is set to True')
 
 
 
+def getTValue(degrees):
+    ''' Function that gets the value of Student's t distribution for 95% confidence intervals
+    with the given degrees of freedom. Up to 30 degrees it is taken from the table; past them
+    it is interpolated linearly in 1/degrees between the tabulated values, as is usual for
+    t tables, which is within 0.001 of the exact value'''
+    if degrees <= len(T_VALUES):
+        return T_VALUES[degrees - 1]
+    points = LARGE_T_VALUES + [(float('inf'), 1.960)]
+    for ((lowDegrees, lowValue), (highDegrees, highValue)) in zip(points, points[1:]):
+        if degrees <= highDegrees:
+            fraction = (1.0/lowDegrees - 1.0/degrees) / (1.0/lowDegrees - 1.0/highDegrees)
+            return lowValue + fraction * (highValue - lowValue)
+
+
+def average(total, count):
+    ''' Function that gets the average of the given total over count values, or NaN if
+    there are no values'''
+    return total / count if count else float('nan')
+
+
+def batches(iterable, size):
+    ''' Function that splits the given iterable into lists of the given size'''
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def terminate(signum, frame):
+    ''' Function that handles SIGTERM by exiting through SystemExit, so the job can
+    write its checkpoint on the way out'''
+    raise SystemExit(128 + signum)
+
+
+def initialiseWorker(params, initialNetwork, best=None):
+    ''' Function that prepares a worker process for simulating parameter combinations'''
+    global workerSimulation, workerNetwork, workerBest
+    # Forked workers inherit the same random state, so each of them has to be reseeded:
+    random.seed()
+    # The workers are stopped with SIGTERM when the pool is terminated:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    workerSimulation = Simulation()
+    workerSimulation.params = params
+    if 'loadStateFile' in params['control']:
+        workerSimulation.readState()
+    workerNetwork = initialNetwork
+    workerBest = best
+
+
+def simulateCombination(combination):
+    ''' Function that simulates a single parameter combination in a worker process'''
+    return (combination, workerSimulation.simulateCombination(workerNetwork, *combination))
+
+
+def simulateReplication(task):
+    ''' Function that simulates a replication of a parameter combination in a worker process'''
+    (combination, replication) = task
+    return workerSimulation.simulateCombination(workerNetwork, *combination, replication=replication)
+
+
+def getCombinationCost(task):
+    ''' Function that gets the cost of a parameter combination run until the given stop time
+    in a worker process'''
+    (combination, stopTime) = task
+    return workerSimulation.getCombinationCost(workerNetwork, combination, stopTime)
+
+
+def evaluateCombination(task):
+    ''' Function that gets the cost of a parameter combination in a worker process. The cost
+    is None if the combination can't beat the best one found by the other workers'''
+    (index, (generalParamSet, roadSet, routeSet)) = task
+    (bestCost, bestIndex) = workerBest
+    parameterSum = workerSimulation.getParameterSum(generalParamSet, roadSet, routeSet)
+    if bestCost.value == 0 and bestIndex.value < index:
+        return (index, None)
+    (key, statistics) = workerSimulation.getCachedStatistics(workerNetwork, (generalParamSet, roadSet, routeSet))
+    if statistics is not None:
+        cost = dict(statistics)['number of missed passengers'] * parameterSum
+    else:
+        # Missed passengers never go down, so once the cost is over the best one the run can stop:
+        cannotWin = lambda: workerSimulation.getMissedPassengers() * parameterSum > bestCost.value
+        if not workerSimulation.runCombination(workerNetwork, generalParamSet, roadSet, routeSet, cannotWin):
+            return (index, None)
+        if key is not None:
+            workerSimulation.storeStatistics(key)
+        cost = workerSimulation.getMissedPassengers() * parameterSum
+    with bestCost.get_lock():
+        if (cost, index) < (bestCost.value, bestIndex.value):
+            bestCost.value = cost
+            bestIndex.value = index
+    return (index, cost)
+
+
+
 if __name__ == '__main__':
     simulation = Simulation()
     fileName = raw_input('Please enter the name of the input file: ')
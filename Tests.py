@@ -1,10 +1,24 @@
 import Parser
 import Models
 import Simulation
+import Events
+import Trace
+import TraceQuery
+import RandomStreams
+import Engines
 import unittest
 from mock import Mock
 from mock import patch
 import random
+import math
+import tempfile
+import os
+import sys
+import signal
+import cPickle
+import subprocess
+from copy import deepcopy
+from StringIO import StringIO
 
 
 class ParserTests(unittest.TestCase):
@@ -89,6 +103,95 @@ class ParserTests(unittest.TestCase):
         self.assertEqual(self.simulation.params['control']['stopTime'], 111.1)
         
     
+    def testWorkers(self):
+        ''' Tests if the number of workers is parsed correctly by the parser'''
+        Parser.Parser._parseLine('workers 8', self.simulation)
+        self.assertEqual(self.simulation.params['control']['workers'], 8)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'workers 4', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'workers 0', Simulation.Simulation())
+        
+    
+    def testEventFile(self):
+        ''' Tests if the event file name is parsed correctly by the parser'''
+        Parser.Parser._parseLine('event file events.txt', self.simulation)
+        self.assertEqual(self.simulation.params['control']['eventFile'], 'events.txt')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'event file other.txt', self.simulation)
+        
+    
+    def testTraceFile(self):
+        ''' Tests if the trace file name is parsed correctly by the parser'''
+        Parser.Parser._parseLine('trace file events.bin', self.simulation)
+        self.assertEqual(self.simulation.params['control']['traceFile'], 'events.bin')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'trace file', Simulation.Simulation())
+        
+    
+    def testSeed(self):
+        ''' Tests if the seed is parsed correctly by the parser'''
+        Parser.Parser._parseLine('seed 42', self.simulation)
+        self.assertEqual(self.simulation.params['control']['seed'], 42)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'seed 7', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'seed 0.5', Simulation.Simulation())
+
+
+    def testCacheFile(self):
+        ''' Tests if the cache file is parsed correctly by the parser'''
+        Parser.Parser._parseLine('cache file results.db', self.simulation)
+        self.assertEqual(self.simulation.params['control']['cacheFile'], 'results.db')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'cache file other.db', self.simulation)
+
+
+    def testCheckpointFile(self):
+        ''' Tests if the checkpoint file is parsed correctly by the parser'''
+        Parser.Parser._parseLine('checkpoint file sweep.checkpoint', self.simulation)
+        self.assertEqual(self.simulation.params['control']['checkpointFile'], 'sweep.checkpoint')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'checkpoint file other.checkpoint', self.simulation)
+
+
+    def testState(self):
+        ''' Tests if the saved and loaded states are parsed correctly by the parser'''
+        Parser.Parser._parseLine('save state warm.state at 500.0', self.simulation)
+        self.assertEqual(self.simulation.params['control']['saveStateFile'], 'warm.state')
+        self.assertEqual(self.simulation.params['control']['saveStateTime'], 500.0)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'save state other.state at 50.0', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'save state warm.state', Simulation.Simulation())
+        Parser.Parser._parseLine('load state warm.state', self.simulation)
+        self.assertEqual(self.simulation.params['control']['loadStateFile'], 'warm.state')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'load state other.state', self.simulation)
+
+
+    def testEngine(self):
+        ''' Tests if the simulation engine is parsed correctly by the parser'''
+        Parser.Parser._parseLine('engine next reaction', self.simulation)
+        self.assertEqual(self.simulation.params['control']['engine'], 'next reaction')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'engine next reaction', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'engine unknown', Simulation.Simulation())
+        simulation = Simulation.Simulation()
+        Parser.Parser._parseLine('engine tau leaping 0.05', simulation)
+        self.assertEqual(simulation.params['control']['engine'], 'tau leaping')
+        self.assertEqual(simulation.params['control']['tau'], 0.05)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'engine tau leaping', Simulation.Simulation())
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'engine tau leaping 0.0', Simulation.Simulation())
+        simulation = Simulation.Simulation()
+        Parser.Parser._parseLine('engine vectorised', simulation)
+        self.assertEqual(simulation.params['control']['engine'], 'vectorised')
+
+
+    def testPrecision(self):
+        ''' Tests if the precision is parsed correctly by the parser'''
+        Parser.Parser._parseLine('precision 0.05', self.simulation)
+        self.assertEqual(self.simulation.params['control']['precision'], 0.05)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'precision 0.1', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'precision 5', Simulation.Simulation())
+
+
+    def testReplications(self):
+        ''' Tests if the number of replications is parsed correctly by the parser'''
+        Parser.Parser._parseLine('replications 200', self.simulation)
+        self.assertEqual(self.simulation.params['control']['replications'], 200)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'replications 3', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'replications 0', Simulation.Simulation())
+        
+    
     def testIgnoreWarnings(self):
         ''' Tests if the ignore warnings flag was set as expected'''
         Parser.Parser._parseLine('ignore warnings', self.simulation)
@@ -101,6 +204,37 @@ class ParserTests(unittest.TestCase):
         self.assertEqual(self.simulation.params['control']['optimiseParameters'], True)
 
 
+    def testGroupPassengers(self):
+        ''' Tests if the group passengers flag was set as expected'''
+        Parser.Parser._parseLine('group passengers', self.simulation)
+        self.assertEqual(self.simulation.params['control']['groupPassengers'], True)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'group passengers', self.simulation)
+
+
+    def testCommonRandomNumbers(self):
+        ''' Tests if the common random numbers flag is parsed correctly by the parser'''
+        Parser.Parser._parseLine('common random numbers', self.simulation)
+        self.assertTrue(self.simulation.params['control']['commonRandomNumbers'])
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'common random numbers', self.simulation)
+        
+        
+    def testOptimiser(self):
+        ''' Tests if the optimiser is parsed correctly by the parser'''
+        Parser.Parser._parseLine('optimiser racing', self.simulation)
+        self.assertEqual(self.simulation.params['control']['optimiser'], 'racing')
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'optimiser racing', self.simulation)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'optimiser unknown', Simulation.Simulation())
+        simulation = Simulation.Simulation()
+        Parser.Parser._parseLine('optimiser local search 50', simulation)
+        self.assertEqual(simulation.params['control']['optimiser'], 'local search')
+        self.assertEqual(simulation.params['control']['budget'], 50)
+        simulation = Simulation.Simulation()
+        Parser.Parser._parseLine('optimiser annealing 20', simulation)
+        self.assertEqual(simulation.params['control']['optimiser'], 'annealing')
+        self.assertEqual(simulation.params['control']['budget'], 20)
+        self.assertRaises(Exception, Parser.Parser._parseLine, 'optimiser annealing', Simulation.Simulation())
+
+
     def testInvalidLine(self):
         '''Tests if error is thrown for an invalid input line'''
         self.assertRaises(Exception, Parser.Parser._parseLine, 'a wrong line', self.simulation)
@@ -258,11 +392,39 @@ class SimulationTests(unittest.TestCase):
         self.assertEqual(self.expectedSimulation, self.simulation)
 
 
+    def testArrivalBlocks(self):
+        ''' This method will check if the new passengers drawn in blocks start at a stop of the
+            network, go to a stop reachable from it and are the same for the same seed'''
+        network = self.simulation.Network
+        network.arrivalBlockSize = 64
+        for numpy in [Models.numpy, None]:
+            with patch('Models.numpy', numpy):
+                network.setRandomStream(RandomStreams.RandomStream(0))
+                network.clearArrivals()
+                network.addPassengers(100, 0, False)
+                self.assertEqual(len(network.arrivals), 28)
+                destinations = [[pax.destStopID for pax in stop.passengers] for stop in network.stops.values()]
+                for stop in network.stops.values():
+                    for pax in stop.passengers:
+                        self.assertTrue(pax.destStopID in stop.reachableStops)
+                    stop.passengers = Models.PassengerList()
+                network.setRandomStream(RandomStreams.RandomStream(0))
+                network.clearArrivals()
+                network.addPassengers(100, 0, False)
+                self.assertEqual([[pax.destStopID for pax in stop.passengers] for stop in network.stops.values()], destinations)
+                for stop in network.stops.values():
+                    stop.passengers = Models.PassengerList()
+        Parser.Parser._parseLine('route 3 stops 8 13 buses 1 capacity 5', self.simulation)
+        self.assertEqual(network.arrivals, [])
+        network.addPassenger(0, False)
+        self.assertTrue(13 in network.stopIDs)
+
+
     def testRates(self):
         ''' This method will check if the event rates are calculated correctly'''
         random.seed(0)
-        self.simulation.Network.changeGeneralParams(self.simulation.generateGeneralParamSets()[0])
-        self.simulation.Network.changeRoadParams(self.simulation.generateRoadSets()[0])
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
         self.simulation.Network.addPassenger(0, False)
         self.simulation.Network.addPassenger(0, False)
         self.assertEqual(self.simulation.getEventRates(), {'paxRTDRate': 0.0, 'paxRTBRate': 0.6, 'busesRTDRate': 2.0, 'busesRTARate': 0})
@@ -275,11 +437,862 @@ class SimulationTests(unittest.TestCase):
         self.simulation.Network.arriveBus(0, False)
         self.assertEqual(self.simulation.getEventRates(), {'paxRTDRate': 0.0, 'paxRTBRate': 0.0, 'busesRTDRate': 3.0, 'busesRTARate': 0})
         
+    
+    def testGroupedPassengers(self):
+        ''' This method will check if the events are carried out in the same way when
+            the passengers are grouped by their destination'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.Network.setPassengerStorage(Models.PassengerGroups)
+        random.seed(0)
+        self.simulation.Network.addPassenger(0, False)
+        self.simulation.Network.addPassenger(0, False)
+        self.assertEqual(self.simulation.Network.stops[5].passengers.counts, {8 : 1})
+        self.assertEqual(self.simulation.getEventRates(), {'paxRTDRate': 0.0, 'paxRTBRate': 0.6, 'busesRTDRate': 2.0, 'busesRTARate': 0})
+        self.simulation.Network.boardPassenger(0, False)
+        self.simulation.Network.boardPassenger(0, False)
+        self.assertEqual(self.simulation.getEventRates(), {'paxRTDRate': 0.0, 'paxRTBRate': 0.0, 'busesRTDRate': 3.0, 'busesRTARate': 0})
+        self.assertEqual(self.simulation.Network.routes[2].buses[1].passengers.counts, {8 : 1})
+        self.assertEqual(len(self.simulation.Network.routes[2].buses[1].passengers), 1)
+        
+
+    def testRouteLookups(self):
+        ''' This method will check if the routes know their stops, next stops and road throughputs'''
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        route = self.simulation.Network.routes[2]
+        self.assertEqual(route.stopSet, set([3, 5, 8]))
+        self.assertEqual(route.nextStops, {3 : 5, 5 : 8, 8 : 3})
+        self.assertEqual(route.nextThroughputs, {3 : 0.3, 5 : 0.6, 8 : 0.8})
+        self.assertEqual(self.simulation.Network.getNextStop(route.buses[1]), 8)
+        self.assertEqual(self.simulation.Network.getThroughput(route.buses[1]), 0.6)
+
+
+    def testCompactObjects(self):
+        ''' This method will check that the network objects don't carry attribute dicts
+            and can still be copied'''
+        network = self.simulation.Network
+        for obj in [Models.Passenger(1), network.stops[1], network.routes[1], network.routes[1].buses[0]]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(deepcopy(network), network)
+
+
+    def testSnapshot(self):
+        ''' This method will check if the network is brought back to the state it was in
+            when the snapshot was taken'''
+        random.seed(0)
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        initialNetwork = deepcopy(self.simulation.Network)
+        snapshot = self.simulation.Network.snapshot()
+        for time in range(300):
+            rates = self.simulation.getEventRates()
+            totalRate = self.simulation.Network.params['new passengers'] + sum(rates.values())
+            self.simulation.executeNextEvent(totalRate, rates, time, False)
+        midRunNetwork = deepcopy(self.simulation.Network)
+        midRunRates = self.simulation.getEventRates()
+        midRunSnapshot = self.simulation.Network.snapshot()
+        self.simulation.Network.restore(snapshot)
+        self.assertEqual(self.simulation.Network, initialNetwork)
+        self.assertEqual(self.simulation.Network.params, initialNetwork.params)
+        self.simulation.Network.restore(midRunSnapshot)
+        self.assertEqual(self.simulation.Network, midRunNetwork)
+        self.assertEqual(self.simulation.getEventRates(), midRunRates)
+
+
+    def testParallelExperimentation(self):
+        ''' This method will check if experimentation in a pool of workers prints the parameter
+            combinations and their statistics in the original order'''
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        self.simulation.params['general']['new passengers'] = [0.5, 0.6]
+        self.simulation.params['control']['stopTime'] = 10.0
+        self.simulation.params['control']['workers'] = 2
+        # In such a short run a stop may see no buses, so the seed is fixed to one where all of them do:
+        self.simulation.params['control']['seed'] = 1
+        output = StringIO()
+        with patch('sys.stdout', output):
+            self.simulation.executeExperimentation(self.simulation.generateParamCombinations())
+        lines = output.getvalue().split('\n')
+        self.assertEqual([line for line in lines if line.startswith('new passengers') or line.startswith('road')],
+                         ['new passengers 0.5', 'road 1 2 0.3', 'new passengers 0.5', 'road 1 2 0.4',
+                          'new passengers 0.5', 'road 1 2 0.5', 'new passengers 0.6', 'road 1 2 0.3',
+                          'new passengers 0.6', 'road 1 2 0.4', 'new passengers 0.6', 'road 1 2 0.5'])
+        self.assertEqual(len([line for line in lines if line.startswith('average queueing at all stops')]), 6)
+        self.assertEqual(self.simulation.Network, self.expectedSimulation.Network)
+
+
+    def testParallelOptimisation(self):
+        ''' This method will check if the parallel optimisation picks the same parameter
+            combination as the serial one'''
+        def fakeSimulationLoop(simulation, outputEvents=True, stopCondition=None, replication=0):
+            network = simulation.Network
+            network.stops[1].missedPassengers = int(round(100 * abs(network.params['new passengers'] - 0.6) + 10 * network.roads[(1, 2)]))
+            return True
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        self.simulation.params['general']['new passengers'] = [0.5, 0.6, 0.7]
+        outputs = []
+        for workers in [1, 3]:
+            self.simulation.params['control']['workers'] = workers
+            output = StringIO()
+            with patch.object(Simulation.Simulation, 'executeSimulationLoop', fakeSimulationLoop):
+                with patch('sys.stdout', output):
+                    self.simulation.executeOptimisation(self.simulation.generateParamCombinations())
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue('new passengers 0.6\nroad 1 2 0.3' in outputs[1])
+
+
+    def testParallelOptimisationWithoutCosts(self):
+        ''' This method will check if the parallel optimisation keeps the first combination,
+            as the serial one does, when none of the runs gives a cost'''
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        initialNetwork = self.simulation.Network.snapshot()
+        # Every run is abandoned:
+        with patch.object(Simulation.Simulation, 'runCombination', return_value=False):
+            bestCombination = self.simulation.executeParallelOptimisation(initialNetwork, self.simulation.generateParamCombinations(), 2)
+        self.assertEqual(bestCombination, next(self.simulation.generateParamCombinations()))
+
+
+    def testSharedBestIndex(self):
+        ''' This method will check if the best cost shared by the optimising workers keeps
+            the indices of combinations past 2^31'''
+        best = (Simulation.multiprocessing.Value('d', float('inf')), Simulation.multiprocessing.Value('d', float('inf')))
+        Simulation.initialiseWorker(self.simulation.params, self.simulation.Network.snapshot(), best)
+        combination = next(self.simulation.generateParamCombinations())
+        # Without any runs no passengers are missed, so every combination costs nothing:
+        with patch.object(Simulation.Simulation, 'executeSimulationLoop', return_value=True):
+            self.assertEqual(Simulation.evaluateCombination((12**10, combination)), (12**10, 0))
+            self.assertEqual((best[0].value, best[1].value), (0, 12**10))
+            # The later combinations can't beat it, but the earlier ones still win the tie:
+            self.assertEqual(Simulation.evaluateCombination((12**10 + 1, combination)), (12**10 + 1, None))
+            self.assertEqual(Simulation.evaluateCombination((12**10 - 1, combination)), (12**10 - 1, 0))
+            self.assertEqual(best[1].value, 12**10 - 1)
+
+
+    def testRacingOptimisation(self):
+        ''' This method will check if the racing optimiser runs the combinations for growing
+            horizons, ending with the whole stop time, and picks the best combination'''
+        horizons = []
+        def fakeSimulationLoop(simulation, outputEvents=True, stopCondition=None, replication=0):
+            network = simulation.Network
+            stopTime = simulation.params['control']['stopTime']
+            horizons.append(stopTime)
+            missed = 100 * abs(network.params['new passengers'] - 0.6) + 10 * network.roads[(1, 2)]
+            # The best combination only comes first over the whole stop time:
+            if network.params['new passengers'] == 0.6 and network.roads[(1, 2)] == 0.5:
+                missed -= {50.0: 1.5, 100.0: 3}.get(stopTime, 0)
+            network.stops[1].missedPassengers = int(round(missed * stopTime))
+            return True
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        self.simulation.params['general']['new passengers'] = [0.5, 0.6, 0.7]
+        self.simulation.params['control']['stopTime'] = 100.0
+        self.simulation.params['control']['optimiser'] = 'racing'
+        output = StringIO()
+        with patch.object(Simulation.Simulation, 'executeSimulationLoop', fakeSimulationLoop):
+            with patch('sys.stdout', output):
+                self.simulation.executeOptimisation(self.simulation.generateParamCombinations())
+        self.assertTrue('new passengers 0.6\nroad 1 2 0.5' in output.getvalue())
+        self.assertEqual(horizons, [12.5] * 9 + [25.0] * 5 + [50.0] * 3 + [100.0] * 2)
+        # The short runs only count as parts of a full evaluation:
+        self.assertTrue('evaluations 5.875' in output.getvalue())
+        self.assertEqual(self.simulation.params['control']['stopTime'], 100.0)
+        self.assertEqual(self.simulation.Network, self.expectedSimulation.Network)
+
+
+    def testSearchOptimisation(self):
+        ''' This method will check if the search strategies find the best combination without
+            simulating more combinations than their budget allows'''
+        def fakeSimulationLoop(simulation, outputEvents=True, stopCondition=None, replication=0):
+            network = simulation.Network
+            network.stops[1].missedPassengers = int(round(100 * abs(network.params['new passengers'] - 0.6) +
+                                                          100 * abs(network.roads[(1, 2)] - 0.5) + 10))
+            return True
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5, 0.6, 0.7]
+        self.simulation.params['general']['new passengers'] = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8]
+        self.simulation.params['control']['seed'] = 2
+        for optimiser in ['local search', 'annealing']:
+            self.simulation.params['control']['optimiser'] = optimiser
+            self.simulation.params['control']['budget'] = 20
+            output = StringIO()
+            with patch.object(Simulation.Simulation, 'executeSimulationLoop', fakeSimulationLoop):
+                with patch('sys.stdout', output):
+                    self.simulation.executeOptimisation(self.simulation.generateParamCombinations())
+            lines = output.getvalue().split('\n')
+            self.assertEqual(lines[1:3], ['new passengers 0.6', 'road 1 2 0.5'])
+            self.assertTrue(lines[3].startswith('evaluations '))
+            self.assertTrue(int(lines[3].split()[1]) <= 20)
+            self.assertEqual(self.simulation.Network, self.expectedSimulation.Network)
+
+
+    def testResultCache(self):
+        ''' This method will check if the seeded runs and replications are taken from the result
+            cache instead of being simulated again, and if the runs with a different stop time are not'''
+        self.simulation.params['control']['seed'] = 6
+        self.simulation.params['control']['cacheFile'] = tempfile.mktemp()
+        initialNetwork = self.simulation.Network.snapshot()
+        combination = next(self.simulation.generateParamCombinations())
+        try:
+            statistics = self.simulation.simulateCombination(initialNetwork, *combination)
+            cost = self.simulation.getCombinationCost(initialNetwork, combination)
+            simulation = Simulation.Simulation()
+            simulation.params = self.simulation.params
+            with patch.object(Simulation.Simulation, 'executeSimulationLoop') as mock:
+                self.assertEqual(simulation.simulateCombination(initialNetwork, *combination), statistics)
+                self.assertEqual(simulation.getCombinationCost(initialNetwork, combination), cost)
+                self.assertFalse(mock.called)
+                simulation.getCombinationCost(initialNetwork, combination, 50.0)
+                self.assertTrue(mock.called)
+            self.simulation.params['control']['replications'] = 2
+            replications = self.simulation.replicateCombination(initialNetwork, combination)
+            self.assertEqual(replications[0], statistics)
+            with patch.object(Simulation.Simulation, 'executeSimulationLoop') as mock:
+                self.assertEqual(simulation.replicateCombination(initialNetwork, combination), replications)
+                self.assertFalse(mock.called)
+            with patch('RandomStreams.numpy', Mock() if RandomStreams.numpy is None else None):
+                self.assertEqual(simulation.getCachedStatistics(initialNetwork, combination)[1], None)
+        finally:
+            os.remove(self.simulation.params['control']['cacheFile'])
+
+
+    def testStatisticsWithoutBuses(self):
+        ''' This method will check if a stop that no bus came to gives a NaN average queueing
+            instead of failing, whether or not the statistics go through the result cache'''
+        initialNetwork = self.simulation.Network.snapshot()
+        combination = next(self.simulation.generateParamCombinations())
+        self.simulation.params['control']['seed'] = 6
+        # Without any events no bus ever comes to stop 8:
+        with patch.object(Simulation.Simulation, 'executeSimulationLoop', return_value=True):
+            uncached = dict(self.simulation.simulateCombination(initialNetwork, *combination))
+            self.simulation.params['control']['cacheFile'] = tempfile.mktemp()
+            try:
+                stored = dict(self.simulation.simulateCombination(initialNetwork, *combination))
+                cached = dict(self.simulation.simulateCombination(initialNetwork, *combination))
+            finally:
+                os.remove(self.simulation.params['control']['cacheFile'])
+        for statistics in [uncached, stored, cached]:
+            self.assertTrue(math.isnan(statistics['average queueing at stop 8']))
+            self.assertEqual(statistics['average queueing at all stops'], 0.0)
+            self.assertEqual(statistics['number of missed passengers'], 0)
+
+
+    def testCheckpoint(self):
+        ''' This method will check if an interrupted experimentation leaves a checkpoint behind,
+            and if the restarted one only simulates the unfinished combinations, prints the
+            same output as an uninterrupted one and removes the checkpoint'''
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        self.simulation.params['general']['new passengers'] = [0.5, 0.6]
+        self.simulation.params['control']['experimentation'] = True
+        self.simulation.params['control']['stopTime'] = 20.0
+        self.simulation.params['control']['checkpointFile'] = tempfile.mktemp()
+        initialNetwork = self.simulation.Network.snapshot()
+        params = deepcopy(self.simulation.params)
+        simulated = []
+        def interruptedCombination(simulation, *combination):
+            if len(simulated) == 4:
+                raise KeyboardInterrupt()
+            simulated.append(combination)
+            return [('number of missed passengers', len(simulated))]
+        outputs = []
+        for interrupted in [True, False]:
+            simulation = Simulation.Simulation()
+            simulation.Network.restore(initialNetwork)
+            simulation.params = deepcopy(params)
+            output = StringIO()
+            with patch.object(Simulation.Simulation, 'simulateCombination', interruptedCombination):
+                with patch('sys.stdout', output):
+                    if interrupted:
+                        self.assertRaises(KeyboardInterrupt, simulation.executeSimulation)
+                        self.assertTrue(os.path.exists(params['control']['checkpointFile']))
+                        simulated = []
+                    else:
+                        simulation.executeSimulation()
+            outputs.append(output.getvalue())
+        self.assertEqual(len(simulated), 2)
+        self.assertEqual(outputs[1].count('number of missed passengers'), 6)
+        self.assertTrue(outputs[1].startswith(outputs[0]))
+        self.assertFalse(os.path.exists(params['control']['checkpointFile']))
+
+
+    def testCheckpointOnSigterm(self):
+        ''' This method will check if an experimentation that is stopped with SIGTERM
+            writes the checkpoint of the combinations it has finished'''
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4, 0.5]
+        self.simulation.params['control']['experimentation'] = True
+        self.simulation.params['control']['checkpointFile'] = tempfile.mktemp()
+        jobFile = tempfile.mktemp()
+        cPickle.dump((self.simulation.Network.snapshot(), self.simulation.params), open(jobFile, 'wb'), 2)
+        script = '\n'.join(['import sys, time, cPickle, Parser, Simulation',
+                             'def slowCombination(simulation, initialNetwork, generalParamSet, roadSet, routeSet):',
+                             '    sys.stderr.write("started\\n")',
+                             '    time.sleep(0.2 if roadSet[(1, 2)] == 0.3 else 60)',
+                             '    return [("number of missed passengers", 1)]',
+                             'Simulation.Simulation.simulateCombination = slowCombination',
+                             'simulation = Simulation.Simulation()',
+                             '(network, simulation.params) = cPickle.load(open(sys.argv[1], "rb"))',
+                             'simulation.Network.restore(network)',
+                             'simulation.executeSimulation()'])
+        process = subprocess.Popen([sys.executable, '-c', script, jobFile], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            # The second combination only starts once the first one is finished:
+            process.stderr.readline()
+            process.stderr.readline()
+            process.send_signal(signal.SIGTERM)
+            process.communicate()
+            self.assertEqual(process.returncode, 128 + signal.SIGTERM)
+            results = cPickle.load(open(self.simulation.params['control']['checkpointFile'], 'rb'))['results']
+            self.assertEqual(results.values(), [[('number of missed passengers', 1)]])
+        finally:
+            if process.poll() is None:
+                process.kill()
+            os.remove(jobFile)
+            if os.path.exists(self.simulation.params['control']['checkpointFile']):
+                os.remove(self.simulation.params['control']['checkpointFile'])
+
+
+    def testSavedState(self):
+        ''' This method will check if a run that is paused, saved and loaded again carries on
+            with exactly the same events and statistics as a run that was not paused'''
+        for commonRandomNumbers in [False, True]:
+            self.simulation.params['control']['seed'] = 12
+            self.simulation.params['control']['commonRandomNumbers'] = commonRandomNumbers
+            self.simulation.params['control']['stopTime'] = 50.0
+            initialNetwork = self.simulation.Network.snapshot()
+            stateFile = tempfile.mktemp()
+            runs = []
+            for control in [{}, {'saveStateFile' : stateFile, 'saveStateTime' : 20.0}, {'loadStateFile' : stateFile}]:
+                simulation = Simulation.Simulation()
+                simulation.params = deepcopy(self.simulation.params)
+                simulation.params['control'].update(control)
+                simulation.applyCombination(initialNetwork, *next(simulation.generateParamCombinations()))
+                if 'loadStateFile' in control:
+                    simulation.readState()
+                    simulation.Network.setState(simulation.startState['network'])
+                events = []
+                simulation.Network.eventSink = Mock()
+                simulation.Network.eventSink.event.side_effect = lambda *event: events.append(event)
+                simulation.executeSimulationLoop()
+                runs.append((events, simulation.getStatistics() if not ('saveStateFile' in control) else None))
+            os.remove(stateFile)
+            self.assertTrue(runs[1][0] and runs[2][0][0][0] > 20.0)
+            self.assertEqual(runs[1][0] + runs[2][0], runs[0][0])
+            self.assertEqual(runs[2][1], runs[0][1])
+
+
+    def testStateStopLayout(self):
+        ''' This method will check if the trees the stops are picked from are laid out as they
+            were saved, whichever order the rebuilt stops dict goes through the stops in'''
+        network = self.simulation.Network
+        network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        for time in range(50):
+            network.addPassenger(time, False)
+        state = network.getState()
+        # Swapping two stops in the saved layouts, as if the stops had been laid out in another order:
+        for name in ['paxRTBStops', 'paxRTDStops', 'busesRTDStops']:
+            (capacity, slots, free) = state[name]
+            (slots[1], slots[3]) = (slots[3], slots[1])
+        loaded = Models.Network()
+        loaded.setState(state)
+        for name in ['paxRTBStops', 'paxRTDStops', 'busesRTDStops']:
+            self.assertEqual(getattr(loaded, name).getLayout(), state[name])
+            tree = getattr(loaded, name)
+            self.assertEqual([tree.items[slot].stopID for (stopID, slot) in sorted(state[name][1].items())],
+                             sorted(state[name][1].keys()))
+            self.assertEqual(tree.total(), getattr(network, name).total())
+
+
+    def testParamCombinations(self):
+        ''' This method will check if all parameter combinations are generated and counted'''
+        self.simulation.params['roads'][(1, 2)] = [0.3, 0.4]
+        self.simulation.params['general']['board'] = [0.3, 0.5, 0.7]
+        self.simulation.params['routes'][2]['capacity'] = [10, 20]
+        combinations = list(self.simulation.generateParamCombinations())
+        self.assertEqual(len(combinations), 12)
+        self.assertEqual(self.simulation.countParamCombinations(), 12)
+        dimensions = self.simulation.getParameterDimensions()
+        self.assertEqual([(kind, key) for (kind, key, values) in dimensions],
+                         [('general', 'board'), ('roads', (1, 2)), ('routes', (2, 'capacity'))])
+        self.assertTrue(self.simulation.getParamCombination(dimensions, (2, 0, 1)) in combinations)
+        self.assertEqual(sorted(set([(general['board'], road[(1, 2)], sorted([route['capacity'] for route in routes])[0])
+                                     for (general, road, routes) in combinations])),
+                         sorted([(board, throughput, capacity) for board in [0.3, 0.5, 0.7]
+                                 for throughput in [0.3, 0.4] for capacity in [10, 20]]))
+
+
+    def testEventOutput(self):
+        ''' This method will check if the events are buffered and written out as the expected lines'''
+        random.seed(0)
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        output = StringIO()
+        self.simulation.Network.eventSink = Events.TextSink(output, bufferSize=3, lazy=True)
+        self.simulation.Network.addPassenger(0, True)
+        self.simulation.Network.addPassenger(0.5, True)
+        self.assertEqual(output.getvalue(), '')
+        self.simulation.Network.boardPassenger(1.5, True)
+        self.assertEqual(len(output.getvalue().split('\n')), 4)
+        self.simulation.Network.departBus(2, True)
+        self.simulation.Network.eventSink.flush()
+        self.assertEqual(output.getvalue().split('\n')[:2],
+                         ['A new passenger enters at stop 5 with destination 8 at time 0.0',
+                          'A new passenger enters at stop 2 with destination 1 at time 0.5'])
+        self.assertTrue(output.getvalue().split('\n')[3].startswith('Bus '))
+        self.simulation.Network.eventSink = Events.NullSink()
+        self.simulation.Network.arriveBus(3, True)
+        self.assertEqual(len(output.getvalue().split('\n')), 5)
+
+
+    def testBinaryTrace(self):
+        ''' This method will check if the events written to a binary trace are read back and
+            converted to the same lines of text as the ones written by the text sink'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        initialNetwork = self.simulation.Network.snapshot()
+        text = StringIO()
+        self.simulation.Network.eventSink = Events.TextSink(text)
+        random.seed(0)
+        self.simulation.executeSimulationLoop()
+        trace = StringIO()
+        self.simulation.Network.restore(initialNetwork)
+        occupancy = dict([(stopID, 0) for stopID in self.simulation.Network.stops])
+        self.simulation.Network.eventSink = Trace.BinarySink(trace, bufferSize=7, occupancy=occupancy)
+        random.seed(0)
+        self.simulation.executeSimulationLoop()
+        replayed = StringIO()
+        trace.seek(0)
+        Trace.replayTrace(trace, Events.TextSink(replayed))
+        lines = text.getvalue().splitlines()
+        header = len(Trace.MAGIC) + Trace.HEADER.size + Trace.OCCUPANCY.size * len(self.simulation.Network.stops)
+        self.assertEqual(len(trace.getvalue()), header + Trace.RECORD.size * len(lines))
+        self.assertEqual(replayed.getvalue().splitlines(), lines)
+        self.assertRaises(Exception, list, Trace.readTrace(StringIO('not a trace')))
+
+
+    def testTauLeapingTrace(self):
+        ''' This method will check if a binary trace of the tau leaping engine, which starts
+            its leaps at the time 0.0, is converted to the same lines as its live output'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.params['control']['engine'] = 'tau leaping'
+        self.simulation.params['control']['tau'] = 0.5
+        self.simulation.params['control']['seed'] = 3
+        initialNetwork = self.simulation.Network.snapshot()
+        text = StringIO()
+        self.simulation.Network.eventSink = Events.TextSink(text)
+        self.simulation.executeSimulationLoop()
+        trace = StringIO()
+        self.simulation.Network.restore(initialNetwork)
+        self.simulation.Network.eventSink = Trace.BinarySink(trace)
+        self.simulation.executeSimulationLoop()
+        replayed = StringIO()
+        trace.seek(0)
+        Trace.replayTrace(trace, Events.TextSink(replayed))
+        lines = text.getvalue().splitlines()
+        self.assertTrue(lines[0].endswith('at time 0.0'))
+        self.assertEqual(replayed.getvalue().splitlines(), lines)
+
+
+    def testNextReactionEngine(self):
+        ''' This method will check if the next reaction engine carries out events in time order
+            and leaves the network in a consistent state'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.params['control']['engine'] = 'next reaction'
+        events = []
+        self.simulation.Network.eventSink = Mock()
+        self.simulation.Network.eventSink.event.side_effect = lambda *event: events.append(event)
+        random.seed(0)
+        self.assertTrue(self.simulation.executeSimulationLoop(outputEvents=True, stopCondition=lambda: False))
+        self.assertTrue(len(events) > 100)
+        self.assertTrue(all(events[i][0] <= events[i + 1][0] for i in range(len(events) - 1)))
+        self.assertTrue(events[-1][0] <= 111.1)
+        self.assertEqual(len([event for event in events if event[1] == Events.NEW_PASSENGER]),
+                         sum([len(stop.passengers) for stop in self.simulation.Network.stops.values()]) +
+                         len([event for event in events if event[1] == Events.BOARD]))
+        network = self.simulation.Network
+        rates = self.simulation.getEventRates()
+        network.updateAllEvents()
+        self.assertEqual(rates, self.simulation.getEventRates())
+        self.assertEqual(len(self.simulation.getStatistics()), 23)
+
+
+    def testTauLeapingEngine(self):
+        ''' This method will check if the tau leaping engine carries out events in time order,
+            moves the buses one at a time and leaves the network in a consistent state'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.params['control']['engine'] = 'tau leaping'
+        self.simulation.params['control']['tau'] = 0.5
+        events = []
+        self.simulation.Network.eventSink = Mock()
+        self.simulation.Network.eventSink.event.side_effect = lambda *event: events.append(event)
+        random.seed(0)
+        self.assertTrue(self.simulation.executeSimulationLoop(outputEvents=True, stopCondition=lambda: False))
+        self.assertTrue(len(events) > 100)
+        self.assertTrue(all(events[i][0] <= events[i + 1][0] for i in range(len(events) - 1)))
+        self.assertTrue(events[-1][0] <= 111.1)
+        busTimes = [event[0] for event in events if event[1] in (Events.DEPART, Events.ARRIVE)]
+        self.assertEqual(len(busTimes), len(set(busTimes)))
+        network = self.simulation.Network
+        rates = self.simulation.getEventRates()
+        network.updateAllEvents()
+        self.assertEqual(rates, self.simulation.getEventRates())
+        self.assertEqual(len(self.simulation.getStatistics()), 23)
+
+
+    def testBatchedPassengerEvents(self):
+        ''' This method will check if the passengers board and disembark in batches
+            only as long as there are places and passengers left'''
+        network = self.simulation.Network
+        bus = network.routes[2].buses[0]
+        bus.capacity = 3
+        stop = network.stops[3]
+        stop.qOfBuses = [bus]
+        for destStopID in [5, 5, 8, 1, 8]:
+            stop.passengers.append(Models.Passenger(destStopID))
+        network.updateStopEvents(stop)
+        self.assertEqual(network.boardPassengersAt(stop, 100, 1.0, False), 3)
+        self.assertEqual(len(bus.passengers), 3)
+        self.assertEqual(stop.passengers.countTo(1), 1)
+        self.assertEqual(network.boardPassengersAt(stop, 100, 1.0, False), 0)
+        bus.passengers[0] = Models.Passenger(3)
+        bus.passengers[1] = Models.Passenger(3)
+        network.updateStopEvents(stop)
+        self.assertEqual(network.disembarkPassengersAt(stop, 1, 2.0, False), 1)
+        self.assertEqual(network.disembarkPassengersAt(stop, 5, 3.0, False), 1)
+        self.assertEqual(bus.passengers.countTo(3), 0)
+        self.assertEqual(len(bus.passengers), 1)
+        self.assertEqual(network.paxRTB[3], 1)
+
+
+    def testSeededRuns(self):
+        ''' This method will check if the runs with the same seed give the same statistics,
+            whatever the state of the random module is'''
+        self.simulation.params['control']['seed'] = 3
+        initialNetwork = self.simulation.Network.snapshot()
+        combination = next(self.simulation.generateParamCombinations())
+        random.seed(1)
+        statistics = self.simulation.simulateCombination(initialNetwork, *combination)
+        random.seed(2)
+        self.assertEqual(self.simulation.simulateCombination(initialNetwork, *combination), statistics)
+        self.simulation.params['control']['seed'] = 4
+        self.assertNotEqual(self.simulation.simulateCombination(initialNetwork, *combination), statistics)
+
+
+    def testCommonRandomNumbers(self):
+        ''' This method will check if the runs with common random numbers get the same new
+            passengers at the same times, even if their other parameters are different'''
+        self.simulation.params['control']['commonRandomNumbers'] = True
+        self.simulation.params['control']['seed'] = 8
+        initialNetwork = self.simulation.Network.snapshot()
+        (generalParamSet, roadSet, routeSet) = next(self.simulation.generateParamCombinations())
+        arrivals = []
+        for board in [0.3, 0.9]:
+            events = []
+            self.simulation.applyCombination(initialNetwork, dict(generalParamSet, board=board), roadSet, routeSet)
+            self.simulation.Network.eventSink = Mock()
+            self.simulation.Network.eventSink.event.side_effect = lambda *event: events.append(event)
+            self.assertTrue(self.simulation.executeSimulationLoop())
+            self.assertTrue(all(events[i][0] <= events[i + 1][0] <= 111.1 for i in range(len(events) - 1)))
+            arrivals.append([event for event in events if event[1] == Events.NEW_PASSENGER])
+        self.assertTrue(len(arrivals[0]) > 20)
+        self.assertEqual(arrivals[0], arrivals[1])
+
+
+    def testReplications(self):
+        ''' This method will check if the seeded replications differ from each other, can be
+            repeated and leave the network as it was before them'''
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.params['control']['seed'] = 5
+        initialNetwork = deepcopy(self.simulation.Network)
+        statistics = self.simulation.simulateReplications(3)
+        self.assertEqual(len(statistics), 3)
+        self.assertNotEqual(statistics[0], statistics[1])
+        self.assertEqual(self.simulation.Network, initialNetwork)
+        self.assertEqual(self.simulation.simulateReplications(2), statistics[:2])
+
+
+    def testSummary(self):
+        ''' This method will check if the means and confidence intervals of the statistics
+            are calculated correctly'''
+        statistics = [[('a', 1), ('b', 2.0)], [('a', 3), ('b', 2.0)]]
+        self.assertEqual(self.simulation.getSummary(statistics), [('a', 2.0, 12.706), ('b', 2.0, 0.0)])
+        self.assertEqual(self.simulation.getSummary(statistics[:1])[0][2], float('inf'))
+        self.assertTrue(self.simulation.isPrecise([('average passengers', 2.0, 0.1), ('a', 2.0, 5.0)], 0.05))
+        self.assertFalse(self.simulation.isPrecise([('average passengers', 2.0, 0.2)], 0.05))
+        self.assertTrue(self.simulation.isPrecise([('number of missed passengers', 0.0, 0.0)], 0.05))
+        self.assertTrue(self.simulation.isPrecise([('number of missed passengers', 0.0001, 0.0005)], 0.05))
+        self.assertFalse(self.simulation.isPrecise([('number of missed passengers', 0.01, 0.01)], 0.05))
+
+
+    def testTValues(self):
+        ''' This method will check if the values of Student's t distribution are within 0.001
+            of the exact ones, inside and past the table'''
+        exact = {1 : 12.706, 2 : 4.303, 10 : 2.228, 30 : 2.042, 35 : 2.030, 50 : 2.009,
+                 80 : 1.990, 100 : 1.984, 200 : 1.972, 1000 : 1.962, 10**6 : 1.960}
+        for (degrees, value) in exact.items():
+            self.assertAlmostEqual(Simulation.getTValue(degrees), value, delta=0.001)
+        values = [Simulation.getTValue(degrees) for degrees in range(1, 500)]
+        self.assertTrue(all(values[i] > values[i + 1] for i in range(len(values) - 1)))
+
+
+    def testAdaptiveReplications(self):
+        ''' This method will check if replications are added until the statistics are precise
+            enough, and if the replications run in parallel give the same statistics'''
+        self.simulation.params['control']['replications'] = 2
+        self.simulation.params['control']['seed'] = 1
+        initialNetwork = self.simulation.Network.snapshot()
+        combination = next(self.simulation.generateParamCombinations())
+        self.assertEqual(len(self.simulation.replicateCombination(initialNetwork, combination)), 2)
+        self.simulation.params['control']['precision'] = 1000.0
+        self.assertEqual(len(self.simulation.replicateCombination(initialNetwork, combination)), 2)
+        self.simulation.params['control']['precision'] = 0.0001
+        with patch('Simulation.MAX_REPLICATIONS', 6):
+            with patch('warnings.warn') as warn:
+                statistics = self.simulation.replicateCombination(initialNetwork, combination)
+                self.assertTrue(warn.called)
+            self.assertEqual(len(statistics), 6)
+            pool = Simulation.multiprocessing.Pool(2, Simulation.initialiseWorker, (self.simulation.params, initialNetwork))
+            self.assertEqual(self.simulation.replicateCombination(initialNetwork, combination, pool), statistics)
+            pool.close()
+            pool.join()
+
+
+    def testExperimentationReplications(self):
+        ''' This method will check if experimentation with replications and a single worker
+            prints the summary of the replications of every parameter combination'''
+        self.simulation.params['general']['disembarks'] = [1.0, 2.0]
+        self.simulation.params['control']['replications'] = 3
+        self.simulation.params['control']['seed'] = 1
+        output = StringIO()
+        with patch('sys.stdout', output):
+            self.simulation.executeExperimentation(self.simulation.generateParamCombinations())
+        lines = output.getvalue().split('\n')
+        self.assertEqual([line for line in lines if line.startswith('disembarks')], ['disembarks 1.0', 'disembarks 2.0'])
+        self.assertEqual([line for line in lines if line.startswith('replications')], ['replications 3'] * 2)
+        self.assertEqual(self.simulation.Network, self.expectedSimulation.Network)
+
+
+    def testVectorisedEngine(self):
+        ''' This method will check if the vectorised engine gives the statistics of every
+            replication, and if they are consistent and repeatable'''
+        if Engines.numpy is None:
+            self.skipTest('NumPy is not installed')
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.params['control']['engine'] = 'vectorised'
+        self.simulation.params['control']['seed'] = 5
+        initialNetwork = deepcopy(self.simulation.Network)
+        statistics = self.simulation.simulateReplications(20)
+        self.assertEqual(len(statistics), 20)
+        names = [name for (name, value) in statistics[0]]
+        self.assertEqual(len(names), 23)
+        for replication in statistics:
+            self.assertEqual([name for (name, value) in replication], names)
+            values = dict(replication)
+            self.assertEqual(values['number of missed passengers'],
+                             values['number of missed passengers route 1'] + values['number of missed passengers route 2'])
+            self.assertTrue(values['average queueing at all stops'] >= 0)
+        self.assertNotEqual(statistics[0], statistics[1])
+        self.assertEqual(self.simulation.Network, initialNetwork)
+        self.assertEqual(self.simulation.simulateReplications(20), statistics)
+
+
+    def testVectorisedValidation(self):
+        ''' This method will check if the vectorised engine is only accepted with replications'''
+        self.simulation.params['control']['engine'] = 'vectorised'
+        # The test network has a road that isn't used by any route:
+        with patch('warnings.warn'):
+            self.assertRaises(Exception, self.simulation.validateSimulation)
+            self.simulation.params['control']['replications'] = 10
+            with patch('Engines.numpy', Mock()):
+                self.simulation.validateSimulation()
+
+
+    def testVectorisedValidationWithoutNumpy(self):
+        ''' This method will check if the vectorised engine is rejected when NumPy is not installed'''
+        self.simulation.params['control']['engine'] = 'vectorised'
+        self.simulation.params['control']['replications'] = 10
+        with patch('warnings.warn'):
+            with patch('Engines.numpy', None):
+                self.assertRaisesRegexp(Exception, 'NumPy', self.simulation.validateSimulation)
+        with patch('RandomStreams.numpy', None):
+            self.assertRaises(Exception, RandomStreams.RandomStream(5).getNumpyRandom)
+
+
+    def testEventIndex(self):
+        ''' This method will check if the incrementally updated possible events and the trees
+            the stops are picked from are the same as the ones recalculated for the entire network'''
+        random.seed(0)
+        self.simulation.Network.changeGeneralParams(next(self.simulation.generateGeneralParamSets()))
+        self.simulation.Network.changeRoadParams(next(self.simulation.generateRoadSets()))
+        self.simulation.Network.changeRouteParams(next(self.simulation.generateRouteSets()))
+        for time in range(500):
+            rates = self.simulation.getEventRates()
+            totalRate = self.simulation.Network.params['new passengers'] + sum(rates.values())
+            self.simulation.executeNextEvent(totalRate, rates, time, False)
+        network = self.simulation.Network
+        events = (dict(network.paxRTB), dict(network.paxRTD), dict(network.busesRTD), sorted(network.busesRTA.getItems()))
+        totals = (network.totalPaxRTB, network.totalPaxRTD, network.totalBusesRTD)
+        throughput = network.busesRTA.total()
+        trees = (network.paxRTBStops, network.paxRTDStops, network.busesRTDStops)
+        self.assertEqual(tuple([tree.total() for tree in trees]), totals)
+        # Every event must be picked at the stop it would be at when going through the stops one by one:
+        for (tree, counts) in [(network.paxRTBStops, network.paxRTB), (network.paxRTDStops, network.paxRTD)]:
+            choices = [(stop, index) for stop in network.stops.values() for index in range(counts[stop.stopID])]
+            self.assertEqual([tree.find(choice) for choice in range(len(choices))], choices)
+        network.updateAllEvents()
+        self.assertEqual(events, (network.paxRTB, network.paxRTD, network.busesRTD, sorted(network.busesRTA.getItems())))
+        self.assertEqual(totals, (network.totalPaxRTB, network.totalPaxRTD, network.totalBusesRTD))
+        self.assertAlmostEqual(throughput, network.busesRTA.total())
+
+
+
+class SumTreeTests(unittest.TestCase):
+
+
+    def testSample(self):
+        ''' Tests if the items are picked according to their weights'''
+        tree = Models.SumTree()
+        for (key, weight) in [('a', 0.5), ('b', 0.0), ('c', 1.5), ('d', 2.0)]:
+            tree.add(key, key, weight)
+        self.assertEqual(tree.total(), 4.0)
+        self.assertEqual([tree.sample(value) for value in [0.0, 0.49, 0.5, 1.99, 2.0, 3.99]],
+                         ['a', 'a', 'c', 'c', 'd', 'd'])
+        self.assertEqual(tree.sample(4.0), 'd')
+        self.assertEqual(tree.find(2.5), ('d', 0.5))
+
+
+    def testRemoveAndUpdate(self):
+        ''' Tests if the total weight follows removed and updated items'''
+        tree = Models.SumTree()
+        for key in range(5):
+            tree.add(key, key, 0.1)
+        self.assertEqual(tree.remove(2), 2)
+        tree.update(4, 1.0)
+        self.assertEqual(len(tree), 4)
+        self.assertAlmostEqual(tree.total(), 1.3)
+        self.assertEqual(tree.sample(0.35), 4)
+        for key in [0, 1, 3, 4]:
+            tree.remove(key)
+        self.assertEqual(tree.total(), 0.0)
+        self.assertEqual(tree.getItems(), [])
+
+
+    def testLayout(self):
+        ''' Tests if a tree rebuilt from the layout of another one picks the same items and
+            puts the new items in the same places'''
+        tree = Models.SumTree()
+        for key in range(6):
+            tree.add(key, key, 0.1 * (key + 1))
+        tree.remove(1)
+        tree.remove(4)
+        copy = Models.SumTree()
+        copy.setLayout(tree.getLayout(), dict([(key, key) for key in [0, 2, 3, 5]]),
+                       dict([(key, 0.1 * (key + 1)) for key in [0, 2, 3, 5]]))
+        self.assertEqual(copy.weights, tree.weights)
+        tree.add(7, 7, 0.3)
+        copy.add(7, 7, 0.3)
+        self.assertEqual([copy.sample(0.1 * value) for value in range(16)], [tree.sample(0.1 * value) for value in range(16)])
+
+
+class RandomStreamTests(unittest.TestCase):
+    
+    def testSeed(self):
+        ''' Tests if the streams with the same seed give the same numbers'''
+        for numpy in [RandomStreams.numpy, None]:
+            with patch('RandomStreams.numpy', numpy):
+                stream1 = RandomStreams.RandomStream(5, blockSize=16)
+                stream2 = RandomStreams.RandomStream(5, blockSize=16)
+                numbers = [stream1.random() for i in range(40)]
+                self.assertEqual([stream2.random() for i in range(40)], numbers)
+                self.assertTrue(all(0 <= number < 1 for number in numbers))
+                self.assertEqual([stream1.exponential() for i in range(40)], [stream2.exponential() for i in range(40)])
+                self.assertTrue(stream1.index(3) in (0, 1, 2))
+
+
+    def testRandomModule(self):
+        ''' Tests if a stream without a seed takes its numbers from the random module'''
+        random.seed(0)
+        expected = [random.random() for i in range(5)]
+        random.seed(0)
+        stream = RandomStreams.RandomStream(blockSize=1)
+        self.assertEqual([stream.random() for i in range(5)], expected)
+
+
+class TraceQueryTests(unittest.TestCase):
+
+
+    def setUp(self):
+        ''' Writing a small trace file to query'''
+        self.fileName = tempfile.mktemp()
+        sink = Trace.BinarySink(open(self.fileName, 'wb'), bufferSize=2)
+        sink.event(0.5, Events.NEW_PASSENGER, -1, -1, 1, 2)
+        sink.event(1.0, Events.NEW_PASSENGER, -1, -1, 1, 3)
+        sink.event(1.5, Events.BOARD, 1, 0, 1, 2)
+        sink.event(2.0, Events.DEPART, 1, 0, 1, -1)
+        sink.event(2.5, Events.NEW_PASSENGER, -1, -1, 2, 1)
+        sink.event(3.0, Events.ARRIVE, 1, 0, 2, -1)
+        sink.event(3.5, Events.DISEMBARK, 1, 0, 2, 2)
+        sink.event(4.0, Events.BOARD, 2, 1, 2, 1)
+        sink.close()
+        self.trace = TraceQuery.TraceFile(self.fileName)
+
+
+    def tearDown(self):
+        self.trace.close()
+        os.remove(self.fileName)
+
+
+    def testEvents(self):
+        ''' Tests if the events and time windows are read correctly'''
+        self.assertEqual(len(self.trace), 8)
+        self.assertEqual(self.trace[3], (2.0, Events.DEPART, 1, 0, 1, -1))
+        self.assertEqual(self.trace.findTime(2.2), 4)
+        self.assertEqual([event[0] for event in self.trace.getEvents(1.0, 2.5)], [1.0, 1.5, 2.0])
+        self.assertEqual([event[1] for event in self.trace.getBusEvents(1, 0, 1.0)],
+                         [Events.BOARD, Events.DEPART, Events.ARRIVE, Events.DISEMBARK])
+
+
+    def testQueries(self):
+        ''' Tests if the stop occupancy and the boardings are calculated correctly'''
+        self.assertEqual(self.trace.getStopOccupancy(1), [(0.0, 0), (0.5, 1), (1.0, 2), (1.5, 1)])
+        self.assertEqual(self.trace.getStopOccupancy(1, 1.2, 3.0), [(1.2, 2), (1.5, 1)])
+        self.assertEqual(self.trace.getStopOccupancy(2, 3.0), [(3.0, 1), (4.0, 0)])
+        self.assertEqual(self.trace.getBoardingsPerRoute(), {1 : 1, 2 : 1})
+        self.assertEqual(self.trace.getBoardingsPerRoute(None, 4.0), {1 : 1})
+
+
+    def testInitialOccupancy(self):
+        ''' Tests if the stop occupancy starts from the passengers and the time in the trace
+            header, as in the trace of a run that loaded a saved state'''
+        fileName = tempfile.mktemp()
+        sink = Trace.BinarySink(open(fileName, 'wb'), startTime=10.0, occupancy={1 : 3, 2 : 0})
+        sink.event(10.5, Events.BOARD, 1, 0, 1, 2)
+        sink.event(11.0, Events.NEW_PASSENGER, -1, -1, 2, 1)
+        sink.event(11.5, Events.BOARD, 1, 1, 1, 3)
+        sink.close()
+        trace = TraceQuery.TraceFile(fileName)
+        try:
+            self.assertEqual((trace.startTime, trace.occupancy), (10.0, {1 : 3, 2 : 0}))
+            self.assertEqual(trace.getStopOccupancy(1), [(10.0, 3), (10.5, 2), (11.5, 1)])
+            self.assertEqual(trace.getStopOccupancy(1, 11.0), [(11.0, 2), (11.5, 1)])
+            self.assertEqual(trace.getStopOccupancy(3), [(10.0, 0)])
+            self.assertEqual(trace.getBusEvents(1, 1), [(11.5, Events.BOARD, 1, 1, 1, 3)])
+            self.assertEqual(trace.getBusEvents(2, 0), [])
+            self.assertEqual(list(Trace.readTrace(open(fileName, 'rb'))), list(trace.getEvents()))
+        finally:
+            trace.close()
+            os.remove(fileName)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ParserTests))
     suite.addTest(unittest.makeSuite(SimulationTests))
+    suite.addTest(unittest.makeSuite(SumTreeTests))
+    suite.addTest(unittest.makeSuite(RandomStreamTests))
+    suite.addTest(unittest.makeSuite(TraceQueryTests))
     return suite
 
 
@@ -0,0 +1,102 @@
+'''
+This file contains the compact binary trace format of the simulation events.
+Every event is stored as a fixed-size record (time, event type, route, bus number,
+stop and destination), which is several times smaller than its line of text and
+much faster to write. The trace can be read back and converted to the text lines.
+The header of the trace holds the start time of the run and the number of passengers
+that were waiting at every stop then, as a run that loaded a saved state doesn't start
+with empty stops.
+'''
+import struct
+import Events
+
+
+# Every trace file starts with this header:
+MAGIC = 'CSLPTRC2'
+# Header layout: start time, number of stops; then stop ID, waiting passengers for every stop.
+HEADER = struct.Struct('<di')
+OCCUPANCY = struct.Struct('<ii')
+# Record layout: time, event type, route ID, bus number, stop ID, destination stop ID.
+# Missing values (e.g. the bus of a new passenger event) are stored as -1.
+RECORD = struct.Struct('<dBiiii')
+
+
+class BinarySink(object):
+    ''' An event sink that writes events as binary records. The records are kept in a buffer
+    and written to the stream in blocks of bufferSize records. The occupancy is a dict of
+    the numbers of passengers waiting at the stops at the start time'''
+    def __init__(self, stream, bufferSize=65536, startTime=0.0, occupancy={}):
+        self.stream = stream
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.stream.write(MAGIC + HEADER.pack(startTime, len(occupancy)))
+        for (stopID, passengers) in sorted(occupancy.items()):
+            self.stream.write(OCCUPANCY.pack(stopID, passengers))
+
+
+    def event(self, time, eventType, routeID, busNumber, stopID, destStopID):
+        ''' Method that receives an event from the bus network'''
+        self.buffer.append(RECORD.pack(time, eventType, routeID, busNumber, stopID, destStopID))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+
+    def flush(self):
+        ''' Method that writes out all of the events received so far'''
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.buffer = []
+
+
+    def close(self):
+        ''' Method that writes out the remaining events and closes the stream'''
+        self.flush()
+        self.stream.close()
+
+
+def readHeader(stream):
+    ''' Function that reads the header of a binary trace from the given stream. It returns
+    the start time of the run and the dict of passengers waiting at the stops then'''
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise Exception('The given file is not an event trace')
+    data = stream.read(HEADER.size)
+    if len(data) != HEADER.size:
+        raise Exception('The event trace is cut short')
+    (startTime, stops) = HEADER.unpack(data)
+    data = stream.read(OCCUPANCY.size * stops)
+    if len(data) != OCCUPANCY.size * stops:
+        raise Exception('The event trace is cut short')
+    occupancy = dict([OCCUPANCY.unpack_from(data, OCCUPANCY.size * i) for i in range(stops)])
+    return (startTime, occupancy)
+
+
+def readTrace(stream, blockSize=65536):
+    ''' Function that reads the events (time, event type, route ID, bus number, stop ID,
+    destination stop ID) of a binary trace from the given stream one by one'''
+    readHeader(stream)
+    while True:
+        block = stream.read(RECORD.size * blockSize)
+        if len(block) % RECORD.size != 0:
+            raise Exception('The event trace is cut short')
+        if not block:
+            return
+        for offset in xrange(0, len(block), RECORD.size):
+            yield RECORD.unpack_from(block, offset)
+
+
+def replayTrace(stream, sink):
+    ''' Function that passes all events of a binary trace to the given event sink'''
+    for event in readTrace(stream):
+        sink.event(*event)
+    sink.flush()
+
+
+def convertTrace(inputFileName, outputFileName):
+    ''' Function that converts a binary trace file to the text lines of its events'''
+    replayTrace(open(inputFileName, 'rb'), Events.TextSink(open(outputFileName, 'w')))
+
+
+
+if __name__ == '__main__':
+    fileName = raw_input('Please enter the name of the trace file: ')
+    replayTrace(open(fileName, 'rb'), Events.TextSink())
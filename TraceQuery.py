@@ -0,0 +1,147 @@
+'''
+This file contains a query interface for binary event traces (see Trace.py).
+The trace file is memory-mapped, so the queries only touch the records that
+they need and multi-gigabyte traces never have to be loaded into memory.
+The queries about buses and stops use an index of the events of every bus and
+stop, which is built by a single pass over the trace the first time it is needed.
+'''
+import mmap
+import struct
+import array
+from bisect import bisect_left
+import Events
+import Trace
+
+
+# The time is the first field of every record:
+TIME = struct.Struct('<d')
+# The changes of the number of passengers waiting at a stop, by event type:
+OCCUPANCY_CHANGES = {Events.NEW_PASSENGER : 1, Events.BOARD : -1}
+
+
+class TraceFile(object):
+    ''' A class representing a memory-mapped binary event trace. The events are indexed
+    in the order they happened, so their times never go down'''
+    def __init__(self, fileName):
+        self.file = open(fileName, 'rb')
+        try:
+            (self.startTime, self.occupancy) = Trace.readHeader(self.file)
+        except Exception:
+            raise Exception('The file {0} is not an event trace'.format(fileName))
+        self.offset = self.file.tell()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if (len(self.map) - self.offset) % Trace.RECORD.size != 0:
+            raise Exception('The event trace {0} is cut short'.format(fileName))
+        self.count = (len(self.map) - self.offset) / Trace.RECORD.size
+        self.busEvents = None
+        self.stopEvents = None
+        self.stopOccupancy = None
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, index):
+        ''' Method that gets the event (time, event type, route ID, bus number, stop ID,
+        destination stop ID) with the given index'''
+        if not (0 <= index < self.count):
+            raise IndexError('Event index out of range')
+        return Trace.RECORD.unpack_from(self.map, self.offset + index * Trace.RECORD.size)
+
+
+    def close(self):
+        ''' Method that releases the memory map and the file'''
+        self.map.close()
+        self.file.close()
+
+
+    def getTime(self, index):
+        ''' Method that gets the time of the event with the given index'''
+        return TIME.unpack_from(self.map, self.offset + index * Trace.RECORD.size)[0]
+
+
+    def findTime(self, time):
+        ''' Method that finds the index of the first event that happened at or after the given
+        time. It uses binary search, so only a few records are read'''
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) / 2
+            if self.getTime(middle) < time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+    def getEvents(self, start=None, end=None):
+        ''' Method that gets the events that happened in the time window [start, end) one by one.
+        A missing start or end leaves the window open on that side'''
+        first = 0 if start is None else self.findTime(start)
+        last = self.count if end is None else self.findTime(end)
+        for index in xrange(first, last):
+            yield self[index]
+
+
+    def buildIndex(self):
+        ''' Method that builds the index of the events of every bus and of the events that
+        change the number of passengers waiting at every stop, together with that number
+        after each of them. The index holds a few bytes per event, so it is several times
+        smaller than the trace'''
+        if self.busEvents is not None:
+            return
+        self.busEvents = {}
+        self.stopEvents = {}
+        self.stopOccupancy = {}
+        occupancy = dict(self.occupancy)
+        for index in xrange(self.count):
+            (time, eventType, routeID, busNumber, stopID, destStopID) = self[index]
+            if busNumber != -1:
+                self.busEvents.setdefault((routeID, busNumber), array.array('l')).append(index)
+            if eventType in OCCUPANCY_CHANGES:
+                occupancy[stopID] = occupancy.get(stopID, 0) + OCCUPANCY_CHANGES[eventType]
+                self.stopEvents.setdefault(stopID, array.array('l')).append(index)
+                self.stopOccupancy.setdefault(stopID, array.array('l')).append(occupancy[stopID])
+
+
+    def findIndices(self, indices, start=None, end=None):
+        ''' Method that finds the part [first, last) of the given sorted event indices that
+        falls into the time window [start, end)'''
+        first = 0 if start is None else bisect_left(indices, self.findTime(start))
+        last = len(indices) if end is None else bisect_left(indices, self.findTime(end))
+        return (first, last)
+
+
+    def getBusEvents(self, routeID, busNumber, start=None, end=None):
+        ''' Method that gets the events of the given bus in the time window [start, end)'''
+        self.buildIndex()
+        indices = self.busEvents.get((routeID, busNumber), [])
+        (first, last) = self.findIndices(indices, start, end)
+        return [self[index] for index in indices[first:last]]
+
+
+    def getStopOccupancy(self, stopID, start=None, end=None):
+        ''' Method that gets the number of passengers waiting at the given stop in the time window
+        [start, end). The result is a list of (time, passengers) pairs: the number at the start of
+        the window and then the new number after every change. The stop starts with the passengers
+        that the trace header gives it, and a missing start is the start time of the run'''
+        self.buildIndex()
+        indices = self.stopEvents.get(stopID, [])
+        counts = self.stopOccupancy.get(stopID, [])
+        (first, last) = self.findIndices(indices, start, end)
+        passengers = counts[first - 1] if first > 0 else self.occupancy.get(stopID, 0)
+        occupancy = [(self.startTime if start is None else start, passengers)]
+        for i in xrange(first, last):
+            occupancy.append((self.getTime(indices[i]), counts[i]))
+        return occupancy
+
+
+    def getBoardingsPerRoute(self, start=None, end=None):
+        ''' Method that counts the passengers that boarded the buses of every route in the
+        time window [start, end)'''
+        boardings = {}
+        for event in self.getEvents(start, end):
+            if event[1] == Events.BOARD:
+                boardings[event[2]] = boardings.get(event[2], 0) + 1
+        return boardings